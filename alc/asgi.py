@@ -13,4 +13,25 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alc.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from payments.moyasar_async import open_async_moyasar_client, close_async_moyasar_client  # noqa: E402
+
+
+async def application(scope, receive, send):
+    """
+    Django's ASGI handler plus the lifespan protocol, which opens the async Moyasar
+    client on startup and closes its connection pool on shutdown.
+    """
+    if scope["type"] != "lifespan":
+        return await django_application(scope, receive, send)
+
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await open_async_moyasar_client()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await close_async_moyasar_client()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
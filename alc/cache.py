@@ -0,0 +1,21 @@
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+
+
+def shared_cache(alias):
+    """
+    The cache named `alias` for data invalidated by model signals, or None when the alias
+    is unset (callers then read the database). The signal runs in whichever process saved
+    the row, so the backend must be shared by every process (database, file, memcached):
+    a process-local LocMemCache is refused.
+    """
+    if not alias:
+        return None
+    cache = caches[alias]
+    if isinstance(cache, LocMemCache):
+        raise ImproperlyConfigured(
+            f"Cache alias '{alias}' is process-local (LocMemCache); "
+            "signal invalidation would not reach the other workers"
+        )
+    return cache
@@ -61,6 +61,16 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # Reverse proxies in front of the app (Railway: 1). The throttles key on the client IP
+    # this many hops from the right of X-Forwarded-For, so clients cannot spoof it; 0 = REMOTE_ADDR
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', 1)),
+    # users/throttling.py (login / forgot-password), checked before any database access
+    'DEFAULT_THROTTLE_RATES': {
+        'login_ip': os.getenv('THROTTLE_LOGIN_IP', '30/min'),
+        'login_email': os.getenv('THROTTLE_LOGIN_EMAIL', '10/min'),
+        'password_reset_ip': os.getenv('THROTTLE_PASSWORD_RESET_IP', '10/hour'),
+        'password_reset_email': os.getenv('THROTTLE_PASSWORD_RESET_EMAIL', '3/hour'),
+    },
 }
 # إعدادات JWT
 SIMPLE_JWT = {
@@ -141,6 +151,79 @@ DATABASES = {
     )
 }
 
+# Cache
+# Local memory by default; set CACHE_BACKEND / CACHE_LOCATION to share it between workers
+# (e.g. django.core.cache.backends.db.DatabaseCache or filebased.FileBasedCache)
+
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.getenv("CACHE_LOCATION", "alc-default"),
+    }
+}
+
+# Cache alias holding the auth throttle windows; point it at a shared backend
+# (file/database) when running several gunicorn workers
+THROTTLE_CACHE_ALIAS = os.getenv("THROTTLE_CACHE_ALIAS", "default")
+
+# Active flag / roles cache behind users.authentication.StatelessJWTAuthentication (seconds)
+USER_STATUS_TIMEOUT = int(os.getenv("USER_STATUS_TIMEOUT", 60))
+
+# Cache alias for each user's unlocked book ids (users/entitlements.py). UserBook signals
+# invalidate it from whichever process unlocks a book, so it must name a backend shared by
+# every process (database, file, memcached); unset = one indexed query per request
+UNLOCKED_BOOKS_CACHE_ALIAS = os.getenv("UNLOCKED_BOOKS_CACHE_ALIAS") or None
+UNLOCKED_BOOKS_TIMEOUT = 60 * 60
+
+# Cache alias for the per-book question id index used by exam generation and book
+# statistics (questions/question_index.py). Like UNLOCKED_BOOKS_CACHE_ALIAS it is
+# invalidated by model signals and must be shared by every process; unset = built from
+# the database on each call
+QUESTION_INDEX_CACHE_ALIAS = os.getenv("QUESTION_INDEX_CACHE_ALIAS") or None
+QUESTION_INDEX_TIMEOUT = 60 * 60
+# Rendered book catalogue, keyed on the Book count / latest updated_at (seconds)
+CATALOGUE_TIMEOUT = 60 * 60
+
+# Logging
+# payments.* يكتب عبر QueueHandler/QueueListener (payments/log.py) حتى لا يحجز الطلب على I/O
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'payments': {
+            'format': '%(asctime)s %(levelname)s %(name)s %(message)s',
+        },
+    },
+    'handlers': {
+        'payments_console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'payments',
+        },
+    },
+    'loggers': {
+        'payments': {
+            'handlers': ['payments_console'],
+            'level': os.getenv('PAYMENTS_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+# نسبة الطلبات التي يُسجل فيها الـ payload كاملاً (على مستوى DEBUG)
+PAYMENTS_LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv('PAYMENTS_LOG_PAYLOAD_SAMPLE_RATE', 0.1))
+
+# Password hashing
+# PASSWORD_PBKDF2_ITERATIONS tunes the login hashing cost; existing hashes are upgraded
+# (or downgraded) to it on the next successful login, in the background if enabled.
+PASSWORD_PBKDF2_ITERATIONS = int(os.getenv("PASSWORD_PBKDF2_ITERATIONS", 1_000_000))
+PASSWORD_REHASH_IN_BACKGROUND = os.getenv("PASSWORD_REHASH_IN_BACKGROUND", "False") == "True"
+PASSWORD_HASHERS = [
+    'users.hashers.TunablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -220,9 +303,20 @@ class Command(BaseCommand):
 MOYASAR_WEBHOOK_SECRET = os.getenv("MOYASAR_WEBHOOK_SECRET")
 MOYASAR_SECRET_KEY = os.getenv("MOYASAR_SECRET_KEY")
 MOYASAR_PUBLISHABLE_KEY = os.getenv("MOYASAR_PUBLISHABLE_KEY")
-MOYASAR_BASE_URL = "https://api.moyasar.com/v1/"
+MOYASAR_BASE_URL = os.getenv("MOYASAR_BASE_URL", "https://api.moyasar.com/v1/")
+MOYASAR_CALLBACK_URL = os.getenv("MOYASAR_CALLBACK_URL", "https://alc-production-5d34.up.railway.app/payments/callback/")
+# HTTP client (payments/moyasar.py): timeouts in seconds, retries apply to GET requests only
+MOYASAR_CONNECT_TIMEOUT = float(os.getenv("MOYASAR_CONNECT_TIMEOUT", 5))
+MOYASAR_READ_TIMEOUT = float(os.getenv("MOYASAR_READ_TIMEOUT", 30))
+MOYASAR_MAX_RETRIES = int(os.getenv("MOYASAR_MAX_RETRIES", 3))
+MOYASAR_RETRY_BACKOFF = float(os.getenv("MOYASAR_RETRY_BACKOFF", 0.5))
+MOYASAR_POOL_SIZE = int(os.getenv("MOYASAR_POOL_SIZE", 10))
 MOYASAR_API_URL = "https://api.moyasar.com/v1/payments"
 
+# Serve create/fetch/callback from payments/async_views.py; also switches the Procfile web process to uvicorn (ASGI).
+# Only under uvicorn alc.asgi:application: its lifespan opens the async Moyasar client, and the views refuse to run without it
+PAYMENTS_ASYNC_VIEWS = os.getenv("PAYMENTS_ASYNC_VIEWS", "False") == "True"
+
 DEBUG=True
 #DEBUG = os.environ.get('DEBUG', 'False') == 'True'
 #SECURE_SSL_REDIRECT = not DEBUG
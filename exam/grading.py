@@ -0,0 +1,366 @@
+"""
+Exam grading engine.
+
+Grades a whole exam in one pass and leaves the results on the ExamQuestion
+instances, so callers persist them with a single bulk_update. Used by
+SubmitExamAPIView and by offline re-grading.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+
+from .models import Exam, ExamQuestion, ExamResult
+from .question_bank import load_questions, snapshot_question
+
+
+GRADED_FIELDS = ["student_answer", "is_correct"]
+
+
+def index_answers(answers):
+    """Map public question id -> submitted answer item, skipping malformed entries"""
+    answers_dict = {}
+    for answer_item in answers:
+        if not isinstance(answer_item, dict):
+            continue
+        public_q_id = answer_item.get('question_id')
+        if public_q_id:
+            answers_dict[str(public_q_id)] = answer_item
+    return answers_dict
+
+
+def grade_question(exam_question, student_answer):
+    """
+    Grade one question against ``student_answer``.
+    Sets exam_question.is_correct and returns (points_earned, points_possible).
+    """
+    question_type = exam_question.question_type
+
+    if question_type == 'mcq':
+        return grade_mcq(exam_question, student_answer), exam_question.points
+    if question_type == 'truefalse':
+        return grade_truefalse(exam_question, student_answer), exam_question.points
+    if question_type == 'matching':
+        return grade_matching(exam_question, student_answer)
+    if question_type == 'reading':
+        return grade_reading(exam_question, student_answer)
+
+    return None
+
+
+def grade_exam(exam_questions, answers_dict):
+    """
+    Grade every question of an exam in one pass.
+
+    ``answers_dict`` is the output of index_answers(). Sets student_answer and
+    is_correct on each ExamQuestion (nothing is saved) and returns
+    (total_score, total_possible, detailed_results).
+    """
+    total_score = Decimal('0')
+    total_possible = Decimal('0')
+    detailed_results = []
+
+    for exam_question in exam_questions:
+        student_answer_data = answers_dict.get(str(exam_question.public_id))
+        question_result = {
+            "question_id": str(exam_question.public_id),
+            "original_question_id": exam_question.question_id,
+            "question_type": exam_question.question_type,
+            "question_text": exam_question.question_text,
+        }
+
+        if student_answer_data:
+            student_answer = student_answer_data.get('answer')
+            exam_question.student_answer = student_answer
+
+            graded = grade_question(exam_question, student_answer)
+            if graded is not None:
+                score, possible_points = graded
+                total_score += score
+                total_possible += possible_points
+
+                question_result.update({
+                    "student_answer": student_answer,
+                    "correct_answer": exam_question.correct_answer,
+                    "is_correct": exam_question.is_correct,
+                    "points_earned": float(score),
+                    "points_possible": float(possible_points),
+                })
+                if exam_question.question_type == 'reading':
+                    question_result["sub_questions_count"] = int(possible_points)
+                if exam_question.question_type in ('matching', 'reading'):
+                    question_result["partial_credit"] = True if score > 0 and score < possible_points else False
+
+        else:
+            # Question not answered
+            possible_points = exam_question.points
+            total_possible += possible_points
+            exam_question.is_correct = False
+
+            question_result.update({
+                "student_answer": None,
+                "correct_answer": exam_question.correct_answer,
+                "is_correct": False,
+                "points_earned": 0,
+                "points_possible": float(possible_points),
+                "error_message": "This question was not answered"
+            })
+
+        detailed_results.append(question_result)
+
+    return total_score, total_possible, detailed_results
+
+
+def percentage_of(total_score, total_possible):
+    return float((total_score / total_possible * 100) if total_possible > 0 else 0)
+
+
+def save_graded_questions(exam_questions, fields=GRADED_FIELDS, batch_size=None):
+    """Persist grading results with one bulk UPDATE"""
+    ExamQuestion.objects.bulk_update(exam_questions, fields, batch_size=batch_size)
+
+
+def stored_answers(exam_questions):
+    """Answers already saved on the questions, in the index_answers() format"""
+    return {
+        str(eq.public_id): {"answer": eq.student_answer}
+        for eq in exam_questions
+        if eq.student_answer is not None
+    }
+
+
+def refresh_snapshots(exam_questions, question_keys):
+    """
+    Re-copy correct_answer/points from the source questions for the rows whose
+    (question_type, question_id) is in ``question_keys``.
+    """
+    ids_by_type = defaultdict(set)
+    for qtype, qid in question_keys:
+        ids_by_type[qtype].add(qid)
+    loaded = load_questions(ids_by_type)
+
+    for eq in exam_questions:
+        if (eq.question_type, eq.question_id) not in question_keys:
+            continue
+        question = loaded.get(eq.question_type, {}).get(eq.question_id)
+        if question is None:
+            continue
+        _, eq.correct_answer, eq.points = snapshot_question(eq.question_type, question)
+
+
+def regrade_exams(exam_ids, question_keys=None, batch_size=500):
+    """
+    Re-grade finished exams from their stored answers and write back
+    ExamQuestion.is_correct, Exam.score and the ExamResult grade in bulk.
+
+    If ``question_keys`` (a set of (question_type, question_id)) is given, the
+    answer snapshots of those questions are refreshed first. Returns the
+    number of exams re-graded.
+    """
+    exam_questions = list(
+        ExamQuestion.objects.filter(exam_id__in=exam_ids).order_by("exam_id", "id")
+    )
+    if question_keys:
+        refresh_snapshots(exam_questions, question_keys)
+
+    questions_by_exam = defaultdict(list)
+    for eq in exam_questions:
+        questions_by_exam[eq.exam_id].append(eq)
+
+    exams = Exam.objects.in_bulk(list(questions_by_exam))
+    results = {r.exam_id: r for r in ExamResult.objects.filter(exam_id__in=list(questions_by_exam))}
+
+    for exam_id, questions in questions_by_exam.items():
+        total_score, total_possible, _ = grade_exam(questions, stored_answers(questions))
+        percentage = percentage_of(total_score, total_possible)
+
+        exams[exam_id].score = total_score
+        result = results.get(exam_id)
+        if result is not None:
+            result.score = total_score
+            result.percentage = Decimal(str(percentage))
+            result.letter_grade = letter_grade(percentage)
+
+    question_fields = ["is_correct", "correct_answer", "points"] if question_keys else ["is_correct"]
+    with transaction.atomic():
+        save_graded_questions(exam_questions, fields=question_fields, batch_size=batch_size)
+        Exam.objects.bulk_update(exams.values(), ["score"], batch_size=batch_size)
+        ExamResult.objects.bulk_update(
+            results.values(), ["score", "percentage", "letter_grade"], batch_size=batch_size
+        )
+
+    return len(questions_by_exam)
+
+
+def grade_mcq(exam_question, student_answer):
+    """Grade multiple choice question"""
+    if not student_answer:
+        exam_question.is_correct = False
+        return Decimal('0')
+
+    correct_answer = exam_question.correct_answer
+    # Clean answers for proper comparison
+    student_clean = str(student_answer).strip().lower()
+    correct_clean = str(correct_answer).strip().lower()
+
+    is_correct = student_clean == correct_clean
+    exam_question.is_correct = is_correct
+    return exam_question.points if is_correct else Decimal('0')
+
+
+def grade_truefalse(exam_question, student_answer):
+    """Grade true/false question"""
+    if student_answer is None:
+        exam_question.is_correct = False
+        return Decimal('0')
+
+    correct_answer = exam_question.correct_answer
+
+    # Handle different answer formats (true/false, 1/0, "true"/"false")
+    if isinstance(student_answer, str):
+        student_answer = student_answer.lower().strip()
+        if student_answer in ['true', '1', 'yes']:
+            student_answer = True
+        elif student_answer in ['false', '0', 'no']:
+            student_answer = False
+
+    is_correct = bool(student_answer) == bool(correct_answer)
+    exam_question.is_correct = is_correct
+    return exam_question.points if is_correct else Decimal('0')
+
+
+def grade_matching(exam_question, student_answer):
+    """Grade matching question with partial credit"""
+    if not student_answer or not isinstance(student_answer, list):
+        exam_question.is_correct = False
+        return Decimal('0'), exam_question.points
+
+    correct_pairs = exam_question.correct_answer
+    if not isinstance(correct_pairs, list) or not correct_pairs:
+        exam_question.is_correct = False
+        return Decimal('0'), exam_question.points
+
+    # Convert correct answers to dictionary
+    correct_dict = {}
+    for pair in correct_pairs:
+        if isinstance(pair, dict) and 'left_item' in pair and 'right_item' in pair:
+            left = str(pair['left_item']).strip().lower()
+            right = str(pair['right_item']).strip().lower()
+            correct_dict[left] = right
+
+    # Convert student answers to dictionary
+    student_dict = {}
+    for pair in student_answer:
+        if isinstance(pair, dict) and 'left_item' in pair and 'right_item' in pair:
+            left = str(pair['left_item']).strip().lower()
+            right = str(pair['right_item']).strip().lower()
+            student_dict[left] = right
+
+    # Calculate partial credit
+    correct_matches = 0
+    total_pairs = len(correct_dict)
+
+    for left_item, correct_right in correct_dict.items():
+        if left_item in student_dict and student_dict[left_item] == correct_right:
+            correct_matches += 1
+
+    # Calculate points based on correct percentage
+    if total_pairs == 0:
+        exam_question.is_correct = False
+        return Decimal('0'), Decimal('1')
+
+    score = Decimal(str(correct_matches))
+    total_possible = Decimal(str(total_pairs))
+
+    # Question is correct only if all matches are correct
+    exam_question.is_correct = (correct_matches == total_pairs)
+
+    return score, total_possible
+
+
+def grade_reading(exam_question, student_answer):
+    """Grade reading comprehension questions with partial credit"""
+    reading_questions = exam_question.correct_answer
+
+    if not isinstance(reading_questions, list) or not reading_questions:
+        exam_question.is_correct = False
+        return Decimal('0'), Decimal('1')
+
+    total_sub_questions = len(reading_questions)
+
+    # Check if student answer exists
+    if not student_answer:
+        exam_question.is_correct = False
+        return Decimal('0'), Decimal(str(total_sub_questions))
+
+    # Calculate points
+    correct_count = 0
+
+    # If student answer is a single string (current case)
+    if isinstance(student_answer, str):
+        # Assume there's only one question in reading comprehension
+        if len(reading_questions) == 1:
+            q_data = reading_questions[0]
+            if isinstance(q_data, dict) and 'correct_answer' in q_data:
+                correct_answer = str(q_data['correct_answer']).strip().lower()
+                student_ans = str(student_answer).strip().lower()
+
+                if correct_answer == student_ans:
+                    correct_count = 1
+
+        # Save result
+        exam_question.is_correct = (correct_count == total_sub_questions)
+        return Decimal(str(correct_count)), Decimal(str(total_sub_questions))
+
+    # If student answer is a list (for future)
+    elif isinstance(student_answer, list):
+        # Convert reading questions to dictionary for quick access
+        correct_answers = {}
+        for i, q_data in enumerate(reading_questions):
+            if isinstance(q_data, dict) and 'question' in q_data and 'correct_answer' in q_data:
+                question_text = str(q_data['question']).strip().lower()
+                correct_answer = str(q_data['correct_answer']).strip().lower()
+                # Use index as fallback key if questions are similar
+                key = f"{question_text}_{i}"
+                correct_answers[key] = correct_answer
+                # Add key without index as well
+                if question_text not in correct_answers:
+                    correct_answers[question_text] = correct_answer
+
+        for i, student_q in enumerate(student_answer):
+            if isinstance(student_q, dict) and 'question' in student_q and 'answer' in student_q:
+                question_text = str(student_q['question']).strip().lower()
+                student_ans = str(student_q['answer']).strip().lower()
+
+                # Try searching with index first, then without
+                key_with_index = f"{question_text}_{i}"
+
+                if key_with_index in correct_answers:
+                    if correct_answers[key_with_index] == student_ans:
+                        correct_count += 1
+                elif question_text in correct_answers:
+                    if correct_answers[question_text] == student_ans:
+                        correct_count += 1
+
+        # Save result
+        exam_question.is_correct = (correct_count == total_sub_questions)
+        return Decimal(str(correct_count)), Decimal(str(total_sub_questions))
+
+    # Other unexpected case
+    else:
+        exam_question.is_correct = False
+        return Decimal('0'), Decimal(str(total_sub_questions))
+
+
+def letter_grade(percentage):
+    """Determine letter grade based on percentage"""
+    if percentage >= 90:
+        return "A"
+    elif percentage >= 80:
+        return "B"
+    elif percentage >= 70:
+        return "C"
+    elif percentage >= 60:
+        return "D"
+    else:
+        return "F"
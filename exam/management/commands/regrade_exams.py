@@ -0,0 +1,127 @@
+import json
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+
+
+# Models are imported lazily so spawned pool workers can import this module before django.setup()
+
+def _init_worker():
+    django.setup()
+
+
+def _regrade_chunk(exam_ids, question_keys, batch_size):
+    from exam.grading import regrade_exams
+
+    return regrade_exams(exam_ids, question_keys=question_keys, batch_size=batch_size)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = "Re-grade finished exams (e.g. after fixing a question's correct answer)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--question-type", choices=["mcq", "matching", "truefalse", "reading"],
+                            help="Only exams containing this question (use with --question-id)")
+        parser.add_argument("--question-id", type=int, action="append", default=[],
+                            help="Source question id; repeat for several questions")
+        parser.add_argument("--book", help="Only exams of this book")
+        parser.add_argument("--all", action="store_true", help="Re-grade every finished exam")
+        parser.add_argument("--no-refresh", action="store_true",
+                            help="Do not re-copy the correct answer from the source questions")
+        parser.add_argument("--chunk-size", type=int, default=200, help="Exams per unit of work")
+        parser.add_argument("--batch-size", type=int, default=500, help="Rows per bulk UPDATE")
+        parser.add_argument("--workers", type=int, default=0,
+                            help="Run chunks in a process pool of this size (0 = in process)")
+        parser.add_argument("--checkpoint", help="File recording the last completed exam id")
+        parser.add_argument("--resume", action="store_true", help="Continue after the id in --checkpoint")
+
+    def handle(self, *args, **options):
+        from exam.models import Exam, ExamQuestion
+
+        question_type = options["question_type"]
+        question_ids = options["question_id"]
+        if bool(question_type) != bool(question_ids):
+            raise CommandError("--question-type and --question-id must be used together")
+        if not (question_ids or options["book"] or options["all"]):
+            raise CommandError("Pass --question-type/--question-id, --book or --all")
+        if options["resume"] and not options["checkpoint"]:
+            raise CommandError("--resume needs --checkpoint")
+
+        exams = Exam.objects.filter(is_finished=True)
+        question_keys = None
+        if question_ids:
+            exams = exams.filter(id__in=ExamQuestion.objects.filter(
+                question_type=question_type, question_id__in=question_ids
+            ).values("exam_id"))
+            if not options["no_refresh"]:
+                question_keys = {(question_type, qid) for qid in question_ids}
+        if options["book"]:
+            exams = exams.filter(book_id=options["book"])
+
+        last_id = self._read_checkpoint(options["checkpoint"]) if options["resume"] else None
+        if last_id is not None:
+            exams = exams.filter(id__gt=last_id)
+            self.stdout.write(f"Resuming after exam {last_id}")
+
+        exam_ids = exams.order_by("id").values_list("id", flat=True).iterator(chunk_size=options["chunk_size"])
+        chunks = _chunks(exam_ids, options["chunk_size"])
+
+        if options["workers"] > 0:
+            total = self._run_pool(chunks, question_keys, options)
+        else:
+            total = 0
+            for chunk in chunks:
+                total += _regrade_chunk(chunk, question_keys, options["batch_size"])
+                self._write_checkpoint(options["checkpoint"], chunk[-1])
+                self.stdout.write(f"Re-graded {total} exams (last id {chunk[-1]})")
+
+        self.stdout.write(self.style.SUCCESS(f"Done, re-graded {total} exams"))
+
+    def _run_pool(self, chunks, question_keys, options):
+        """Keep at most 2 chunks per worker in flight and checkpoint in id order"""
+        from django.db import connections
+
+        connections.close_all()
+        total = 0
+        pending = deque()
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(options["workers"], mp_context=context, initializer=_init_worker) as pool:
+            for chunk in chunks:
+                pending.append((chunk[-1], pool.submit(_regrade_chunk, chunk, question_keys, options["batch_size"])))
+                while len(pending) >= options["workers"] * 2:
+                    total += self._collect(pending, options["checkpoint"], total)
+            while pending:
+                total += self._collect(pending, options["checkpoint"], total)
+        return total
+
+    def _collect(self, pending, checkpoint, total):
+        last_id, future = pending.popleft()
+        done = future.result()
+        self._write_checkpoint(checkpoint, last_id)
+        self.stdout.write(f"Re-graded {total + done} exams (last id {last_id})")
+        return done
+
+    def _read_checkpoint(self, path):
+        if not os.path.exists(path):
+            return None
+        with open(path) as fh:
+            return json.load(fh).get("last_exam_id")
+
+    def _write_checkpoint(self, path, last_id):
+        if not path:
+            return
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as fh:
+            json.dump({"last_exam_id": last_id}, fh)
+        os.replace(tmp_path, path)
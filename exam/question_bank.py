@@ -0,0 +1,183 @@
+from collections import defaultdict
+import random
+
+from django.db.models import prefetch_related_objects
+
+from questions.models import (
+    MCQQuestion, MatchingQuestion, TrueFalseQuestion, ReadingComprehension
+)
+from questions.question_index import QUESTION_MODELS, get_question_index, refresh_question_index
+from .models import ExamQuestion
+
+
+DIFFICULTY_LEVELS = ["easy", "medium", "hard"]
+
+
+def question_querysets():
+    """Base queryset per question type, with the relations its serializer reads"""
+    return {
+        "mcq": MCQQuestion.objects.prefetch_related("choices"),
+        "matching": MatchingQuestion.objects.prefetch_related("pairs"),
+        "truefalse": TrueFalseQuestion.objects.all(),
+        "reading": ReadingComprehension.objects.select_related("book"),
+    }
+
+
+def load_questions(ids_by_type):
+    """
+    Load source questions grouped by type with one query per type
+    (plus its prefetch). Returns {question_type: {id: question}}.
+    """
+    querysets = question_querysets()
+    loaded = {}
+    for question_type, ids in ids_by_type.items():
+        queryset = querysets.get(question_type)
+        if queryset is None or not ids:
+            loaded[question_type] = {}
+            continue
+        loaded[question_type] = queryset.in_bulk(list(ids))
+    return loaded
+
+
+def hydrate_exam_questions(exam_questions):
+    """
+    Pair every ExamQuestion with its source question, keeping the exam order.
+    Returns a list of (exam_question, question); question is None if it was deleted.
+    """
+    exam_questions = list(exam_questions)
+
+    ids_by_type = defaultdict(set)
+    for eq in exam_questions:
+        ids_by_type[eq.question_type].add(eq.question_id)
+
+    loaded = load_questions(ids_by_type)
+
+    return [
+        (eq, loaded.get(eq.question_type, {}).get(eq.question_id))
+        for eq in exam_questions
+    ]
+
+
+def snapshot_question(question_type, question):
+    """
+    Build the (question_text, correct_answer, points) copy stored on ExamQuestion.
+    Matching questions must have their pairs prefetched.
+    """
+    if question_type == "mcq":
+        return question.text, question.correct_answer, 1
+
+    if question_type == "truefalse":
+        return question.text, question.is_true, 1
+
+    if question_type == "matching":
+        pairs_data = [{
+            "match_key": p.match_key,
+            "left_item": p.left_item,
+            "right_item": p.right_item
+        } for p in question.pairs.all()]
+        return question.text, pairs_data, max(1, len(pairs_data))
+
+    if question_type == "reading":
+        reading_questions = []
+
+        if hasattr(question, 'questions_data') and isinstance(question.questions_data, list):
+            for item in question.questions_data:
+                if isinstance(item, dict):
+                    reading_questions.append({
+                        "question": item.get("question", ""),
+                        "correct_answer": item.get("correct_answer", ""),
+                        "choices": item.get("choices", []) if item.get("type") == "mcq" else []
+                    })
+
+        return question.title, reading_questions, max(1, len(reading_questions))
+
+    raise ValueError(f"Unknown question type: {question_type}")
+
+
+def build_exam_questions(exam, selected):
+    """
+    Materialize unsaved ExamQuestion rows for [(question_type, question), ...].
+    Pairs of all selected matching questions are fetched in one query.
+    """
+    matching = [q for qtype, q in selected if qtype == "matching"]
+    if matching:
+        prefetch_related_objects(matching, "pairs")
+
+    rows = []
+    for qtype, q in selected:
+        question_text, correct_answer, points = snapshot_question(qtype, q)
+        rows.append(ExamQuestion(
+            exam=exam,
+            question_type=qtype,
+            question_id=q.id,
+            question_text=question_text,
+            correct_answer=correct_answer,
+            points=points
+        ))
+    return rows
+
+
+def sample_question_keys(book_id, difficulty, total_required):
+    """
+    Pick [(question_type, id), ...] for a new exam from the cached question index.
+
+    Every question of the requested difficulty is a candidate. If there are
+    fewer than ``total_required``, the gap is filled with random questions of
+    the other difficulties, taking MCQ first, then matching, true/false and
+    reading. Returns (selected_keys, total_available).
+    """
+    index = get_question_index(book_id)
+
+    pool = []
+    for qtype in QUESTION_MODELS:
+        pool += [(qtype, qid) for qid in index[qtype].get(difficulty, [])]
+
+    remaining = total_required - len(pool)
+    if remaining > 0:
+        other_levels = [level for level in DIFFICULTY_LEVELS if level != difficulty]
+
+        for qtype in QUESTION_MODELS:
+            if remaining <= 0:
+                break
+
+            extra_ids = [qid for level in other_levels for qid in index[qtype].get(level, [])]
+            take = random.sample(extra_ids, min(remaining, len(extra_ids)))
+            pool += [(qtype, qid) for qid in take]
+            remaining -= len(take)
+
+    if len(pool) < total_required:
+        return [], len(pool)
+
+    return random.sample(pool, total_required), len(pool)
+
+
+def sample_exam_questions(book_id, difficulty, total_required, _retry=True):
+    """
+    Like sample_question_keys, but loads only the chosen rows.
+    Returns ([(question_type, question), ...], total_available).
+
+    If some chosen rows are gone (deleted, or moved to another book, while the
+    index was cached), the index is rebuilt from the database and the sample
+    drawn again, so the exam never comes back short.
+    """
+    keys, total_available = sample_question_keys(book_id, difficulty, total_required)
+
+    ids_by_type = defaultdict(list)
+    for qtype, qid in keys:
+        ids_by_type[qtype].append(qid)
+
+    # The book filter drops ids left in a stale index by a question moved to another book
+    loaded = {
+        qtype: QUESTION_MODELS[qtype].objects.filter(book_id=book_id).in_bulk(ids)
+        for qtype, ids in ids_by_type.items()
+    }
+
+    selected = [
+        (qtype, loaded[qtype][qid])
+        for qtype, qid in keys
+        if qid in loaded[qtype]
+    ]
+    if len(selected) < len(keys) and _retry:
+        refresh_question_index(book_id)
+        return sample_exam_questions(book_id, difficulty, total_required, _retry=False)
+    return selected, total_available
@@ -1,8 +1,6 @@
 from rest_framework import serializers
 from .models import Exam, ExamQuestion
-from questions.models import (
-    MCQQuestion, MatchingQuestion, TrueFalseQuestion, ReadingComprehension
-)
+from .question_bank import hydrate_exam_questions
 from questions.serializers import (
     MCQQuestionSerializer, MatchingQuestionSerializer,
     TrueFalseQuestionSerializer, ReadingComprehensionSerializer
@@ -25,15 +23,17 @@ class ExamSerializer(serializers.ModelSerializer):
 
     def get_exam_questions(self, obj):
         result = []
-        for eq in obj.exam_questions.all():
+        # Load every source question with one query per type instead of one per row
+        for eq, question in hydrate_exam_questions(obj.exam_questions.all()):
+            if question is None:
+                continue
+
             question_data = None
 
             if eq.question_type == "mcq":
-                question = MCQQuestion.objects.get(id=eq.question_id)
                 question_data = MCQQuestionSerializer(question).data
 
             elif eq.question_type == "matching":
-                question = MatchingQuestion.objects.get(id=eq.question_id)
                 data = MatchingQuestionSerializer(question).data
                 shuffled_data = data.copy()
                 matching_pairs = shuffled_data.get("matching_pairs", [])
@@ -47,11 +47,9 @@ class ExamSerializer(serializers.ModelSerializer):
                 question_data = shuffled_data
 
             elif eq.question_type == "truefalse":
-                question = TrueFalseQuestion.objects.get(id=eq.question_id)
                 question_data = TrueFalseQuestionSerializer(question).data
 
             elif eq.question_type == "reading":
-                question = ReadingComprehension.objects.get(id=eq.question_id)
                 question_data = ReadingComprehensionSerializer(question).data
 
             if question_data:
@@ -1,3 +1,34 @@
 from django.test import TestCase
 
-# Create your tests here.
+from questions.models import Book, MatchingQuestion, MatchingPair
+from users.models import CustomUser
+from .models import Exam, ExamQuestion
+from .serializers import ExamSerializer
+
+
+class ExamSerializerQueryCountTests(TestCase):
+    """Serializing an exam must not query matching pairs once per question"""
+
+    @classmethod
+    def setUpTestData(cls):
+        book = Book.objects.create(title="Book")
+        student = CustomUser.objects.create_user("s@example.com", "Student", "student", password="x")
+        cls.exam = Exam.objects.create(student=student, book=book)
+        for i in range(5):
+            question = MatchingQuestion.objects.create(
+                book=book, difficulty="easy", question_text=f"q{i}", text=f"q{i}"
+            )
+            MatchingPair.objects.bulk_create([
+                MatchingPair(question=question, left_item=f"l{j}", right_item=f"r{j}", match_key=f"k{j}")
+                for j in range(3)
+            ])
+            ExamQuestion.objects.create(
+                exam=cls.exam, question_type="matching", question_id=question.id,
+                question_text=question.text, correct_answer=[]
+            )
+
+    def test_exam_serializer_prefetches_pairs(self):
+        # exam questions + matching questions + their pairs
+        with self.assertNumQueries(3):
+            data = ExamSerializer(self.exam).data
+        self.assertEqual(len(data['exam_questions']), 5)
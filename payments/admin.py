@@ -1,4 +1,27 @@
 from django.contrib import admin
-from .models import Payment,Invoice
+from .models import Payment, Invoice, WebhookEvent, PaymentEvent, ArchivedPayment
+from .exports import stream_invoices_csv, stream_invoices_jsonl
+
 admin.site.register(Payment)
-admin.site.register(Invoice)
\ No newline at end of file
+
+
+@admin.register(Invoice)
+class InvoiceAdmin(admin.ModelAdmin):
+    list_display = ['invoice_number', 'customer_email', 'amount', 'status', 'created_at', 'paid_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['invoice_number', 'customer_email', 'payment__moyasar_id']
+    list_select_related = ['payment']
+    actions = ['export_csv', 'export_jsonl']
+
+    @admin.action(description="Export selected invoices as CSV")
+    def export_csv(self, request, queryset):
+        return stream_invoices_csv(queryset.order_by('created_at', 'pk'))
+
+    @admin.action(description="Export selected invoices as JSONL")
+    def export_jsonl(self, request, queryset):
+        return stream_invoices_jsonl(queryset.order_by('created_at', 'pk'))
+
+
+admin.site.register(WebhookEvent)
+admin.site.register(PaymentEvent)
+admin.site.register(ArchivedPayment)
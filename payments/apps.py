@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class PaymentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'payments'
+
+    def ready(self):
+        from .log import start_queue_logging
+
+        start_queue_logging()
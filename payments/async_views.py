@@ -0,0 +1,142 @@
+"""
+نسخ async من CreatePaymentView و fetch_payment_view و payment_callback_view لوضع ASGI
+(PAYMENTS_ASYNC_VIEWS=True مع uvicorn). انتظار Moyasar يتم بـ AsyncMoyasarClient بدون حجز worker،
+وكل خطوات قاعدة البيانات هي نفس helpers الـ views العادية عبر sync_to_async.
+"""
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.shortcuts import render
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from .moyasar_async import get_async_moyasar_client
+from .views import (
+    validate_create_payment, create_payment_request, record_created_payment, sync_fetched_payment,
+    claim_pending_payment, attach_user_from_description, record_callback_payment, settle_callback_payment,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+async def authenticate(request, authentication_class):
+    """يرجع (user, None) أو (None, JsonResponse 401) مثل IsAuthenticated في DRF"""
+    try:
+        result = await sync_to_async(authentication_class().authenticate)(request)
+    except AuthenticationFailed as e:
+        # simplejwt يرفع detail كـ dict ({"detail", "code"}) كما يعرضه DRF
+        body = e.detail if isinstance(e.detail, dict) else {"detail": e.detail}
+        return None, JsonResponse(body, status=e.status_code)
+    if result is None:
+        return None, JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+    return result[0], None
+
+
+@csrf_exempt
+@require_POST
+async def create_payment_view(request):
+    # الدفع مربوط بالمستخدم نفسه، فهنا نحتاج الـ CustomUser كامل
+    user, error = await authenticate(request, JWTAuthentication)
+    if error:
+        return error
+
+    try:
+        data = json.loads(request.body or b"{}")
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return JsonResponse({"success": False, "error": "Invalid JSON body"}, status=400)
+
+    try:
+        token, book, error = await sync_to_async(validate_create_payment)(data)
+        if error:
+            body, status = error
+            return JsonResponse(body, status=status)
+
+        request_kwargs = create_payment_request(user, book, token)
+        payment_response, status_code = await get_async_moyasar_client().create_payment(**request_kwargs)
+
+        body, status = await sync_to_async(record_created_payment)(
+            user, book, request_kwargs, payment_response, status_code
+        )
+        return JsonResponse(body, status=status)
+
+    except Exception as e:
+        logger.error("❌ Error in create_payment_view: %s", e, exc_info=True)
+        return JsonResponse({"success": False, "error": str(e)}, status=500)
+
+
+@require_GET
+async def fetch_payment_view(request, moyasar_id):
+    # نفس مصادقة fetch_payment_view العادية (JWTAuthentication يرفض الحساب غير المفعّل)
+    _, error = await authenticate(request, JWTAuthentication)
+    if error:
+        return error
+
+    try:
+        data, status_code = await get_async_moyasar_client().fetch_payment(moyasar_id)
+
+        if status_code == 200:
+            return JsonResponse({
+                "moyasar_data": data,
+                "local_payment": await sync_to_async(sync_fetched_payment)(moyasar_id, data),
+            })
+        else:
+            return JsonResponse({"error": data}, status=status_code)
+    except Exception as e:
+        logger.error("Error in fetch_payment_view: %s", e)
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+@csrf_exempt
+async def payment_callback_view(request):
+    try:
+        status = request.GET.get("status")
+        moyasar_id = request.GET.get("id")
+        payment_session_id = request.GET.get("session_id")
+
+        logger.info("📞 Callback - Status: %s, Moyasar ID: %s, Session: %s", status, moyasar_id, payment_session_id)
+
+        payment = None
+        invoice = None
+
+        if moyasar_id:
+            client = get_async_moyasar_client()
+            try:
+                if payment_session_id:
+                    payment, missing_user = await sync_to_async(claim_pending_payment)(payment_session_id, moyasar_id)
+                    if missing_user:
+                        payment_data, _ = await client.fetch_payment(moyasar_id)
+                        await sync_to_async(attach_user_from_description)(payment, payment_data)
+
+                if not payment:
+                    payment_data, status_code = await client.fetch_payment(moyasar_id)
+
+                    if status_code != 200:
+                        logger.error("❌ Failed to fetch from Moyasar: %s", payment_data)
+                        raise Exception("Could not verify payment")
+
+                    payment = await sync_to_async(record_callback_payment)(moyasar_id, payment_data)
+
+                invoice = await sync_to_async(settle_callback_payment)(payment, moyasar_id)
+
+            except Exception as e:
+                logger.error("❌ Error in callback: %s", e, exc_info=True)
+
+        # القالب قد يقرأ علاقات من قاعدة البيانات، فالـ render نفسه خارج الـ event loop
+        return await sync_to_async(render)(request, "payments/payment_success.html", {
+            "payment": payment,
+            "invoice": invoice,
+            "status": status,
+        })
+
+    except Exception as e:
+        logger.error("❌ Critical error in callback: %s", e, exc_info=True)
+        return await sync_to_async(render)(request, "payments/payment_failed.html", {
+            "error": "حدث خطأ في معالجة الدفعة"
+        })
@@ -0,0 +1,67 @@
+import csv
+import json
+from functools import lru_cache
+
+from django.http import StreamingHttpResponse
+from django.template.loader import get_template
+
+
+INVOICE_CSV_COLUMNS = [
+    ('invoice_number', lambda invoice: invoice.invoice_number),
+    ('payment_moyasar_id', lambda invoice: invoice.payment.moyasar_id),
+    ('payment_status', lambda invoice: invoice.payment.status),
+    ('status', lambda invoice: invoice.status),
+    ('amount', lambda invoice: invoice.amount),
+    ('tax_amount', lambda invoice: invoice.tax_amount),
+    ('total_amount', lambda invoice: invoice.total_amount),
+    ('currency', lambda invoice: invoice.currency),
+    ('customer_name', lambda invoice: invoice.customer_name),
+    ('customer_email', lambda invoice: invoice.customer_email),
+    ('customer_phone', lambda invoice: invoice.customer_phone),
+    ('created_at', lambda invoice: invoice.created_at.isoformat()),
+    ('paid_at', lambda invoice: invoice.paid_at.isoformat() if invoice.paid_at else ''),
+]
+
+
+class _Echo:
+    """csv.writer target that hands each row back instead of buffering it"""
+
+    def write(self, value):
+        return value
+
+
+def invoice_csv_rows(queryset, chunk_size=2000):
+    writer = csv.writer(_Echo())
+    yield writer.writerow([name for name, _ in INVOICE_CSV_COLUMNS])
+    for invoice in queryset.select_related('payment').iterator(chunk_size=chunk_size):
+        yield writer.writerow([value(invoice) for _, value in INVOICE_CSV_COLUMNS])
+
+
+def invoice_jsonl_rows(queryset, chunk_size=2000):
+    for invoice in queryset.select_related('payment').iterator(chunk_size=chunk_size):
+        record = {name: value(invoice) for name, value in INVOICE_CSV_COLUMNS}
+        yield json.dumps(record, ensure_ascii=False, default=str) + "\n"
+
+
+def stream_invoices_csv(queryset, filename="invoices.csv"):
+    """Stream the invoices as CSV, reading them from the database in chunks"""
+    response = StreamingHttpResponse(invoice_csv_rows(queryset), content_type="text/csv; charset=utf-8")
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+def stream_invoices_jsonl(queryset, filename="invoices.jsonl"):
+    response = StreamingHttpResponse(invoice_jsonl_rows(queryset), content_type="application/x-ndjson")
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+@lru_cache(maxsize=None)
+def _invoice_batch_template():
+    # Compiled once per process, even when the cached template loader is off (DEBUG)
+    return get_template("payments/invoice_batch.html")
+
+
+def render_invoice_batch(invoices):
+    """One printable HTML document containing every invoice in ``invoices``"""
+    return _invoice_batch_template().render({"invoices": invoices})
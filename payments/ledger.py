@@ -0,0 +1,126 @@
+import logging
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import Invoice, Payment, PaymentEvent
+from users.models import UserBook
+
+
+logger = logging.getLogger(__name__)
+
+
+class _UnlockFailed(Exception):
+    pass
+
+
+def record_payment_event(moyasar_id, event_type, source):
+    """
+    يسجل الحدث في PaymentEvent (INSERT واحد داخل savepoint).
+    Returns: True إذا كان هذا أول تسجيل للحدث، False إذا سبقنا أحد (webhook/callback)
+    """
+    try:
+        with transaction.atomic():
+            PaymentEvent.objects.create(moyasar_id=moyasar_id, event_type=event_type, source=source)
+        return True
+    except IntegrityError:
+        return False
+
+
+def unlock_user_book(payment):
+    """
+    🔥 FIXED: فك قفل الكتاب للمستخدم بعد الدفع الناجح
+    Returns: True إذا نجحت العملية، False إذا فشلت
+    """
+    try:
+        user = payment.user
+        book = payment.book
+
+        # ✅ التحقق من وجود المستخدم والكتاب
+        if not user:
+            logger.error("❌ Payment %s has no user!", payment.moyasar_id)
+            return False
+
+        if not book:
+            logger.error("❌ Payment %s has no book!", payment.moyasar_id)
+            return False
+
+        # ✅ استخدام transaction للتأكد من سلامة البيانات
+        with transaction.atomic():
+            user_book, created = UserBook.objects.update_or_create(
+                user=user,
+                book=book,
+                defaults={
+                    "status": "unlocked",
+                    "payment": payment
+                }
+            )
+
+            if created:
+                logger.info("✅ NEW: User %s unlocked %s", user.email, book.title)
+            else:
+                logger.info("✅ UPDATED: User %s unlocked %s", user.email, book.title)
+
+        return True
+
+    except Exception as e:
+        logger.error("❌ Critical error unlocking book for payment %s: %s", payment.moyasar_id, e, exc_info=True)
+        return False
+
+
+def update_invoice_on_payment_success(payment):
+    """
+    تحديث الفاتورة عند نجاح الدفع (UPDATE واحد، لا يعيد تحديث فاتورة مدفوعة)
+    """
+    try:
+        with transaction.atomic():
+            updated = Invoice.objects.filter(payment=payment, paid_at__isnull=True).update(
+                status='paid', paid_at=timezone.now()
+            )
+        if updated:
+            logger.info("✅ Invoice for payment %s marked as paid", payment.moyasar_id)
+        else:
+            logger.info("ℹ️ No unpaid invoice for payment %s", payment.moyasar_id)
+    except Exception as e:
+        logger.error("❌ Error updating invoice for payment %s: %s", payment.moyasar_id, e, exc_info=True)
+
+
+def settle_paid_payment(payment, source):
+    """
+    يطبق انتقال paid مرة واحدة فقط: يسجل الحدث، يفك قفل الكتاب ويحدث الفاتورة
+    في transaction واحدة. لو فشل فك القفل يُلغى تسجيل الحدث حتى تعيد المحاولة التالية.
+    Returns: True إذا الكتاب مفتوح (الآن أو من حدث سابق)
+    """
+    if not payment.user_id or not payment.book_id:
+        logger.warning("⚠️ Cannot unlock - missing user or book for %s", payment.moyasar_id)
+        return False
+
+    try:
+        with transaction.atomic():
+            if not record_payment_event(payment.moyasar_id, 'paid', source):
+                logger.info("ℹ️ Payment %s already settled, skipping (%s)", payment.moyasar_id, source)
+                return True
+            if not unlock_user_book(payment):
+                raise _UnlockFailed()
+            update_invoice_on_payment_success(payment)
+    except _UnlockFailed:
+        logger.error("❌ Failed to unlock book for %s, will retry on the next event", payment.moyasar_id)
+        return False
+
+    logger.info("✅ Payment %s settled via %s", payment.moyasar_id, source)
+    return True
+
+
+def apply_payment_status_event(moyasar_id, event_type, source):
+    """
+    يطبق حدث failed/refunded على الدفعة مرة واحدة (الدفعة مقفولة بـ select_for_update).
+    Returns: True إذا تم التطبيق الآن
+    Raises: Payment.DoesNotExist
+    """
+    with transaction.atomic():
+        payment = Payment.objects.select_for_update().get(moyasar_id=moyasar_id)
+        if not record_payment_event(moyasar_id, event_type, source):
+            return False
+        payment.status = event_type
+        payment.save(update_fields=['status', 'updated_at'])
+    return True
@@ -0,0 +1,73 @@
+import atexit
+import json
+import logging
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+
+from django.conf import settings
+
+
+class LazyJSON:
+    """يحوّل الـ payload لـ JSON فقط عند كتابة السجل فعلياً"""
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def __str__(self):
+        return json.dumps(self.payload, ensure_ascii=False, default=str)
+
+
+def log_payload(logger, message, payload, level=logging.DEBUG, sample_rate=None):
+    """
+    يسجل payload كامل (Moyasar response / webhook body) بمستوى DEBUG افتراضياً،
+    لنسبة PAYMENTS_LOG_PAYLOAD_SAMPLE_RATE فقط من الطلبات.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if sample_rate is None:
+        sample_rate = settings.PAYMENTS_LOG_PAYLOAD_SAMPLE_RATE
+    if sample_rate < 1 and random.random() >= sample_rate:
+        return
+    logger.log(level, "%s: %s", message, LazyJSON(payload))
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler يضع الـ record كما هو في الـ queue: QueueHandler.prepare() الأصلية
+    تستدعي self.format() في thread الطلب (ومعها LazyJSON.__str__)، أما هنا فالتنسيق
+    يتم في thread الـ QueueListener عبر formatter كل handler.
+    الـ queue داخل نفس الـ process فلا حاجة لجعل الـ record قابلاً للـ pickle،
+    لكن الـ payload الممرر لـ log_payload يجب ألا يُعدّل بعد تسجيله.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+_listener = None
+
+
+def start_queue_logging(logger_name="payments"):
+    """
+    ينقل handlers الـ logger (من إعداد LOGGING) إلى QueueListener في thread منفصل،
+    ويضع مكانها DeferredQueueHandler حتى لا ينتظر الطلب تنسيق السجل ولا كتابته.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    logger = logging.getLogger(logger_name)
+    handlers = [h for h in logger.handlers if not isinstance(h, QueueHandler)]
+    if not handlers:
+        return None
+
+    log_queue = queue.SimpleQueue()
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(DeferredQueueHandler(log_queue))
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
@@ -0,0 +1,90 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from payments.models import ArchivedPayment, Payment
+
+
+ARCHIVED_FIELDS = [
+    "user_id", "book_id", "moyasar_id", "amount", "status", "currency",
+    "description", "created_at", "updated_at", "source_type",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete abandoned pending_form payments and archive old failed/canceled payments, "
+        "in bounded batches. Meant to run on a schedule."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pending-ttl", type=int, default=24,
+                            help="Hours after which an abandoned payment form is deleted")
+        parser.add_argument("--archive-after", type=int, default=180,
+                            help="Days after which failed/canceled payments are archived (0 = never)")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows per DELETE / archive batch")
+        parser.add_argument("--max-batches", type=int, default=0,
+                            help="Stop each phase after this many batches (0 = until done)")
+        parser.add_argument("--dry-run", action="store_true", help="Only count what would be removed")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        # لا نلمس أي دفعة مرتبطة بفاتورة أو كتاب مفتوح
+        unreferenced = Payment.objects.filter(invoice__isnull=True, user_book__isnull=True)
+
+        # pending_form، أو نماذج متروكة ألغاها reconcile_payments (ما زال moyasar_id مؤقت)
+        abandoned = unreferenced.filter(
+            Q(status="pending_form") | Q(status="canceled", moyasar_id__startswith="PENDING-"),
+            created_at__lt=now - timedelta(hours=options["pending_ttl"]),
+        )
+        terminal = None
+        if options["archive_after"]:
+            terminal = unreferenced.filter(
+                status__in=["failed", "canceled"],
+                created_at__lt=now - timedelta(days=options["archive_after"]),
+            ).exclude(moyasar_id__startswith="PENDING-")
+
+        if options["dry_run"]:
+            self.stdout.write(f"Would delete {abandoned.count()} abandoned payment forms")
+            if terminal is not None:
+                self.stdout.write(f"Would archive {terminal.count()} failed/canceled payments")
+            return
+
+        deleted = self.run_batches(abandoned, self.delete_batch, options)
+        self.stdout.write(f"Deleted {deleted} abandoned payment forms")
+        if terminal is not None:
+            archived = self.run_batches(terminal, self.archive_batch, options)
+            self.stdout.write(f"Archived {archived} failed/canceled payments")
+
+    def run_batches(self, queryset, apply, options):
+        total = batches = 0
+        while True:
+            ids = list(queryset.order_by("pk").values_list("pk", flat=True)[:options["batch_size"]])
+            if not ids:
+                break
+            total += apply(queryset, ids)
+            batches += 1
+            if options["max_batches"] and batches >= options["max_batches"]:
+                break
+        return total
+
+    # الـ filter يتكرر وقت الحذف: دفعة اتغيرت بعد الـ SELECT (مثلاً callback دفعها) لا تُحذف
+
+    def delete_batch(self, queryset, ids):
+        _, deleted = queryset.filter(pk__in=ids).delete()
+        return deleted.get(Payment._meta.label, 0)
+
+    def archive_batch(self, queryset, ids):
+        with transaction.atomic():
+            # نقفل الصفوف اللي لسه مطابقة، فنأرشف ونحذف نفس المجموعة بالضبط
+            ids = list(queryset.filter(pk__in=ids).select_for_update(of=("self",)).values_list("pk", flat=True))
+            payments = Payment.objects.filter(pk__in=ids).values("pk", *ARCHIVED_FIELDS)
+            ArchivedPayment.objects.bulk_create(
+                [ArchivedPayment(original_id=row.pop("pk"), **row) for row in payments],
+                ignore_conflicts=True,
+            )
+            _, deleted = Payment.objects.filter(pk__in=ids).delete()
+        return deleted.get(Payment._meta.label, 0)
@@ -0,0 +1,134 @@
+import multiprocessing
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, time, timedelta
+from itertools import islice
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+
+
+# Models are imported lazily so spawned pool workers can import this module before django.setup()
+
+def _init_worker():
+    django.setup()
+
+
+def _render_batch(invoice_ids, path):
+    from payments.exports import render_invoice_batch
+    from payments.models import Invoice
+
+    invoices = Invoice.objects.select_related("payment").filter(pk__in=invoice_ids).order_by("created_at", "pk")
+    with open(path, "w", encoding="utf-8") as fp:
+        fp.write(render_invoice_batch(list(invoices)))
+    return len(invoice_ids)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _parse_month(value):
+    try:
+        start = datetime.strptime(value, "%Y-%m").date()
+    except ValueError:
+        raise CommandError("--month must look like YYYY-MM")
+    end = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start, end
+
+
+class Command(BaseCommand):
+    help = "Export invoices as CSV, JSONL or batched printable HTML files"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=["csv", "jsonl", "html"], default="csv")
+        parser.add_argument("--month", help="Only invoices created in this month (YYYY-MM)")
+        parser.add_argument("--from", dest="date_from", type=date.fromisoformat,
+                            help="Created on or after this date (YYYY-MM-DD)")
+        parser.add_argument("--to", dest="date_to", type=date.fromisoformat,
+                            help="Created on or before this date (YYYY-MM-DD)")
+        parser.add_argument("--status", help="Only invoices with this status")
+        parser.add_argument("--output", default="-",
+                            help="File for csv/jsonl ('-' = stdout), directory for html")
+        parser.add_argument("--batch-size", type=int, default=500, help="Invoices per HTML file")
+        parser.add_argument("--workers", type=int, default=0,
+                            help="Render HTML batches in a process pool of this size (0 = in process)")
+
+    def handle(self, *args, **options):
+        from django.utils import timezone
+        from payments.models import Invoice
+
+        invoices = Invoice.objects.order_by("created_at", "pk")
+        date_from, date_to = options["date_from"], options["date_to"]
+        if options["month"]:
+            date_from, month_end = _parse_month(options["month"])
+            date_to = month_end - timedelta(days=1)
+        if date_from:
+            invoices = invoices.filter(created_at__gte=timezone.make_aware(datetime.combine(date_from, time.min)))
+        if date_to:
+            invoices = invoices.filter(
+                created_at__lt=timezone.make_aware(datetime.combine(date_to + timedelta(days=1), time.min))
+            )
+        if options["status"]:
+            if options["status"] not in dict(Invoice.INVOICE_STATUS_CHOICES):
+                raise CommandError(f"Unknown status {options['status']}")
+            invoices = invoices.filter(status=options["status"])
+
+        if options["format"] == "html":
+            count = self.export_html(invoices, options)
+        else:
+            count = self.export_rows(invoices, options)
+        self.stderr.write(self.style.SUCCESS(f"Exported {count} invoices"))
+
+    def export_rows(self, invoices, options):
+        from payments.exports import invoice_csv_rows, invoice_jsonl_rows
+
+        rows = invoice_csv_rows(invoices) if options["format"] == "csv" else invoice_jsonl_rows(invoices)
+        output = options["output"]
+        fp = sys.stdout if output == "-" else open(output, "w", encoding="utf-8", newline="")
+        count = -1 if options["format"] == "csv" else 0  # CSV header row
+        try:
+            for row in rows:
+                fp.write(row)
+                count += 1
+        finally:
+            if fp is not sys.stdout:
+                fp.close()
+        return count
+
+    def export_html(self, invoices, options):
+        output = options["output"]
+        if output == "-":
+            raise CommandError("--format html needs --output DIRECTORY")
+        os.makedirs(output, exist_ok=True)
+
+        batches = (
+            (ids, os.path.join(output, f"invoices-{number:05d}.html"))
+            for number, ids in enumerate(
+                _chunks(invoices.values_list("pk", flat=True).iterator(), options["batch_size"]), start=1
+            )
+        )
+
+        count = 0
+        if not options["workers"]:
+            for ids, path in batches:
+                count += _render_batch(ids, path)
+            return count
+
+        # spawn, not fork: forked children would share the parent's database connection
+        context = multiprocessing.get_context("spawn")
+        max_in_flight = options["workers"] * 2
+        with ProcessPoolExecutor(max_workers=options["workers"], mp_context=context,
+                                 initializer=_init_worker) as pool:
+            in_flight = deque()
+            for ids, path in batches:
+                in_flight.append(pool.submit(_render_batch, ids, path))
+                if len(in_flight) >= max_in_flight:
+                    count += in_flight.popleft().result()
+            while in_flight:
+                count += in_flight.popleft().result()
+        return count
@@ -0,0 +1,78 @@
+import asyncio
+import statistics
+import time
+from collections import Counter
+
+import httpx
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire concurrent requests at the payment endpoints of a running server and report throughput "
+        "and latency. Run the server against `moyasar_stub --delay N` to see how many gateway calls "
+        "it can wait on at once (sync workers vs PAYMENTS_ASYNC_VIEWS under uvicorn)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+        parser.add_argument("--endpoint", choices=["fetch", "create"], default="fetch")
+        parser.add_argument("--email", required=True, help="User the access token is issued for")
+        parser.add_argument("--book-id", help="Book to pay for (--endpoint create)")
+        parser.add_argument("--moyasar-id", default="load-test", help="Payment id to fetch (--endpoint fetch)")
+        parser.add_argument("--requests", type=int, default=100)
+        parser.add_argument("--concurrency", type=int, default=50)
+        parser.add_argument("--timeout", type=float, default=120)
+
+    def handle(self, *args, **options):
+        from users.authentication import tokens_for_user
+        from users.models import CustomUser
+
+        try:
+            user = CustomUser.objects.get(email=options["email"])
+        except CustomUser.DoesNotExist:
+            raise CommandError(f"No user {options['email']}")
+        if options["endpoint"] == "create" and not options["book_id"]:
+            raise CommandError("--endpoint create needs --book-id")
+
+        access = str(tokens_for_user(user).access_token)
+        latencies, statuses, elapsed = asyncio.run(self.run(options, access))
+
+        self.stdout.write(f"{len(latencies)} requests, concurrency {options['concurrency']}, {elapsed:.2f}s total")
+        self.stdout.write(f"throughput: {len(latencies) / elapsed:.1f} req/s")
+        self.stdout.write("status: " + ", ".join(f"{code}={count}" for code, count in sorted(statuses.items(), key=lambda item: str(item[0]))))
+        if latencies:
+            ordered = sorted(latencies)
+            p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+            self.stdout.write(
+                f"latency: p50={statistics.median(ordered):.3f}s p95={p95:.3f}s max={ordered[-1]:.3f}s"
+            )
+
+    async def run(self, options, access):
+        headers = {"Authorization": f"Bearer {access}"}
+        if options["endpoint"] == "fetch":
+            method, path, body = "GET", f"/payments/fetch/{options['moyasar_id']}/", None
+        else:
+            method, path = "POST", "/payments/create/"
+            body = {"book_id": options["book_id"], "source": {"token": "tok_load_test"}}
+
+        semaphore = asyncio.Semaphore(options["concurrency"])
+        latencies, statuses = [], Counter()
+        limits = httpx.Limits(max_connections=options["concurrency"])
+
+        async with httpx.AsyncClient(base_url=options["base_url"], headers=headers, limits=limits,
+                                     timeout=options["timeout"]) as client:
+            async def one():
+                async with semaphore:
+                    started = time.perf_counter()
+                    try:
+                        response = await client.request(method, path, json=body)
+                        statuses[response.status_code] += 1
+                    except httpx.HTTPError as e:
+                        statuses[type(e).__name__] += 1
+                    latencies.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(one() for _ in range(options["requests"])))
+            elapsed = time.perf_counter() - started
+        return latencies, statuses, elapsed
@@ -0,0 +1,146 @@
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from django.core.management.base import BaseCommand
+
+
+PAGE_SIZE = 20
+
+
+class StubState:
+    def __init__(self, delay, failure_rate):
+        self.delay = delay
+        self.failure_rate = failure_rate
+        self.payments = {}
+        self.lock = threading.Lock()
+
+
+class MoyasarStubHandler(BaseHTTPRequestHandler):
+    """Just enough of the Moyasar v1 payments API for local testing"""
+
+    state = None
+
+    def _send(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _route(self):
+        if self.state.delay:
+            time.sleep(self.state.delay)
+        if random.random() < self.state.failure_rate:
+            self._send(503, {"type": "api_error", "message": "Stub injected failure"})
+            return None
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        if parts[:1] == ["v1"]:
+            parts = parts[1:]
+        if parts[:1] != ["payments"]:
+            self._send(404, {"type": "invalid_request_error", "message": "Not found"})
+            return None
+        return parts[1:], parse_qs(url.query)
+
+    def do_GET(self):
+        route = self._route()
+        if route is None:
+            return
+        parts, query = route
+        with self.state.lock:
+            if not parts:
+                # Like Moyasar: newest first
+                payments = list(reversed(self.state.payments.values()))
+                page = int(query.get("page", ["1"])[0])
+                total_pages = max(1, -(-len(payments) // PAGE_SIZE))
+                self._send(200, {
+                    "payments": payments[(page - 1) * PAGE_SIZE:page * PAGE_SIZE],
+                    "meta": {
+                        "current_page": page,
+                        "next_page": page + 1 if page < total_pages else None,
+                        "prev_page": page - 1 if page > 1 else None,
+                        "total_pages": total_pages,
+                        "total_count": len(payments),
+                    },
+                })
+                return
+            payment = self.state.payments.get(parts[0])
+        if payment is None:
+            self._send(404, {"type": "record_not_found", "message": "Payment not found"})
+        else:
+            self._send(200, payment)
+
+    def do_POST(self):
+        route = self._route()
+        if route is None:
+            return
+        parts, _ = route
+        data = self._read_json()
+        with self.state.lock:
+            if not parts:
+                token = (data.get("source") or {}).get("token", "")
+                payment = {
+                    "id": str(uuid.uuid4()),
+                    "status": "failed" if token.startswith("fail") else "paid",
+                    "amount": data.get("amount"),
+                    "currency": data.get("currency", "SAR"),
+                    "description": data.get("description"),
+                    "metadata": data.get("metadata") or {},
+                    "callback_url": data.get("callback_url"),
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "source": {"type": "token", "transaction_url": None},
+                }
+                self.state.payments[payment["id"]] = payment
+                self._send(201, payment)
+                return
+            payment = self.state.payments.get(parts[0])
+            if payment is None or parts[1:] != ["refund"]:
+                self._send(404, {"type": "record_not_found", "message": "Payment not found"})
+                return
+            payment["status"] = "refunded"
+            payment["refunded"] = data.get("amount") or payment["amount"]
+            self._send(200, payment)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    # load_test_payments opens many connections at once; the default backlog (5) resets them
+    request_queue_size = 256
+    daemon_threads = True
+
+
+class Command(BaseCommand):
+    help = "Run a local Moyasar API stub (point MOYASAR_BASE_URL at http://HOST:PORT/v1/)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--delay", type=float, default=0, help="Seconds to wait before every response")
+        parser.add_argument("--failure-rate", type=float, default=0,
+                            help="Fraction of requests answered with 503 (0-1)")
+
+    def handle(self, *args, **options):
+        handler = type("Handler", (MoyasarStubHandler,), {
+            "state": StubState(options["delay"], options["failure_rate"]),
+        })
+        server = StubServer((options["host"], options["port"]), handler)
+        self.stdout.write(f"Moyasar stub on http://{options['host']}:{options['port']}/v1/")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
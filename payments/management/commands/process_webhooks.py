@@ -0,0 +1,49 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from payments.webhooks import MAX_ATTEMPTS, claim_events, process_event
+
+
+def _process(event):
+    try:
+        return process_event(event)
+    finally:
+        # كل thread يفتح اتصاله الخاص بقاعدة البيانات
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Drain the Moyasar webhook inbox (WebhookEvent). Safe to run several copies."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4, help="Events processed concurrently")
+        parser.add_argument("--batch-size", type=int, default=50, help="Events claimed per round")
+        parser.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS,
+                            help="Give up on an event after this many attempts")
+        parser.add_argument("--sleep", type=float, default=2, help="Seconds to wait when the inbox is empty")
+        parser.add_argument("--once", action="store_true", help="Exit when no events are due")
+
+    def handle(self, *args, **options):
+        processed = failed = 0
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            try:
+                while True:
+                    close_old_connections()
+                    events = claim_events(options["batch_size"], options["max_attempts"])
+                    if not events:
+                        if options["once"]:
+                            break
+                        time.sleep(options["sleep"])
+                        continue
+
+                    for ok in pool.map(_process, events):
+                        processed += 1
+                        failed += not ok
+                    self.stdout.write(f"Processed {processed} events ({failed} failed)")
+            except KeyboardInterrupt:
+                pass
+
+        self.stdout.write(self.style.SUCCESS(f"Done: {processed} events, {failed} failed"))
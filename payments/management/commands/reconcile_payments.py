@@ -0,0 +1,121 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from payments.ledger import record_payment_event, settle_paid_payment
+from payments.models import Payment
+from payments.moyasar import get_moyasar_client
+
+
+SYNCED_STATUSES = {choice for choice, _ in Payment.PAYMENT_STATUS_CHOICES} - {"pending_form"}
+# Payments still waiting for Moyasar to settle them
+OPEN_STATUSES = ("initiated", "pending")
+
+
+class Command(BaseCommand):
+    help = "Sync local Payment status from Moyasar's payment list and expire stale pending_form payments"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--max-pages", type=int, default=20,
+                            help="Stop after this many Moyasar pages (0 = no limit)")
+        parser.add_argument("--window-margin", type=int, default=60,
+                            help="Minutes before the oldest open local payment (or before now, if none) "
+                                 "past which Moyasar pages are not read")
+        parser.add_argument("--full", action="store_true",
+                            help="Read the whole Moyasar history (ignores --window-margin and --max-pages)")
+        parser.add_argument("--pending-ttl", type=int, default=60,
+                            help="Minutes after which an unused pending_form payment is canceled")
+        parser.add_argument("--no-expire", action="store_true", help="Do not touch pending_form payments")
+        parser.add_argument("--dry-run", action="store_true", help="Report changes without saving them")
+
+    def handle(self, *args, **options):
+        client = get_moyasar_client()
+        cutoff = None if options["full"] else self.window_start(options["window_margin"])
+        max_pages = 0 if options["full"] else options["max_pages"]
+        page = 1
+        pages = seen = changed = unknown = 0
+
+        while page:
+            data = client.list_payments(page=page)
+            if "payments" not in data:
+                raise CommandError(f"Moyasar list failed on page {page}: {data}")
+
+            remote = {p["id"]: p for p in data["payments"] if p.get("id")}
+            seen += len(remote)
+            local = Payment.objects.select_related("user", "book").in_bulk(
+                list(remote), field_name="moyasar_id"
+            )
+            unknown += len(remote) - len(local)
+
+            updates = [
+                (payment, remote[moyasar_id])
+                for moyasar_id, payment in local.items()
+                if remote[moyasar_id].get("status") in SYNCED_STATUSES
+                and remote[moyasar_id]["status"] != payment.status
+            ]
+            changed += len(updates)
+            for payment, remote_payment in updates:
+                self.stdout.write(f"{payment.moyasar_id}: {payment.status} -> {remote_payment['status']}")
+            if updates and not options["dry_run"]:
+                self.apply_page(updates)
+
+            pages += 1
+            if max_pages and pages >= max_pages:
+                break
+            # Moyasar lists newest first: once a page reaches back past the window, stop
+            if cutoff and self.reaches_before(data["payments"], cutoff):
+                break
+            page = (data.get("meta") or {}).get("next_page")
+
+        expired = 0
+        if not options["no_expire"]:
+            stale = Payment.objects.filter(
+                status="pending_form",
+                created_at__lt=timezone.now() - timedelta(minutes=options["pending_ttl"]),
+            )
+            expired = stale.count() if options["dry_run"] else stale.update(
+                status="canceled", updated_at=timezone.now()
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{pages} pages, {seen} Moyasar payments, {changed} updated, "
+            f"{unknown} not found locally, {expired} pending_form expired"
+        ))
+
+    def window_start(self, margin_minutes):
+        """Creation time before which nothing can still need syncing"""
+        oldest_open = (
+            Payment.objects.filter(status__in=OPEN_STATUSES)
+            .order_by("created_at").values_list("created_at", flat=True).first()
+        )
+        return (oldest_open or timezone.now()) - timedelta(minutes=margin_minutes)
+
+    def reaches_before(self, payments, cutoff):
+        created = [parse_datetime(p.get("created_at") or "") for p in payments]
+        created = [value for value in created if value]
+        return bool(created) and min(created) < cutoff
+
+    def apply_page(self, updates):
+        """One transaction per Moyasar page: a bulk UPDATE, then the ledger transitions"""
+        now = timezone.now()
+        with transaction.atomic():
+            for payment, remote_payment in updates:
+                payment.status = remote_payment["status"]
+                if remote_payment.get("amount") is not None:
+                    payment.amount = remote_payment["amount"]
+                if payment.status == "paid" and not payment.paid_at:
+                    payment.paid_at = now
+                payment.updated_at = now
+            Payment.objects.bulk_update(
+                [payment for payment, _ in updates],
+                ["status", "amount", "paid_at", "updated_at"],
+            )
+
+            for payment, _ in updates:
+                if payment.status == "paid":
+                    settle_paid_payment(payment, "reconcile")
+                elif payment.status in ("failed", "refunded"):
+                    record_payment_event(payment.moyasar_id, payment.status, "reconcile")
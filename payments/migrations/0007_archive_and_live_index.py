@@ -0,0 +1,42 @@
+# Generated by Django 5.2 on 2026-10-18 06:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0006_paymentevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedPayment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_id', models.BigIntegerField()),
+                ('user_id', models.UUIDField(blank=True, null=True)),
+                ('book_id', models.UUIDField(blank=True, null=True)),
+                ('moyasar_id', models.CharField(max_length=100, unique=True)),
+                ('amount', models.IntegerField()),
+                ('status', models.CharField(choices=[('pending_form', 'Pending Form'), ('initiated', 'Initiated'), ('pending', 'Pending'), ('paid', 'Paid'), ('failed', 'Failed'), ('refunded', 'Refunded'), ('canceled', 'Canceled')], max_length=20)),
+                ('currency', models.CharField(default='SAR', max_length=10)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('source_type', models.CharField(blank=True, max_length=50, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='payment',
+            name='payments_pa_user_id_01767a_idx',
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(condition=models.Q(('status', 'pending_form'), _negated=True), fields=['user', 'status'], name='payment_user_status_live'),
+        ),
+    ]
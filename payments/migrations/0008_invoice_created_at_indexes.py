@@ -0,0 +1,21 @@
+# Generated by Django 5.2 on 2026-10-18 06:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0007_archive_and_live_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['created_at'], name='payments_in_created_d4aa22_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['status', 'created_at'], name='payments_in_status_a745e9_idx'),
+        ),
+    ]
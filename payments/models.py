@@ -32,7 +32,12 @@ class Payment(models.Model):
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['moyasar_id']),
-            models.Index(fields=['user', 'status']),
+            # partial index: صفحات الدفع المتروكة (pending_form) لا تدخل في استعلامات المستخدم
+            models.Index(
+                fields=['user', 'status'],
+                condition=~models.Q(status='pending_form'),
+                name='payment_user_status_live',
+            ),
             models.Index(fields=['status']),
         ]
 
@@ -42,6 +47,31 @@ class Payment(models.Model):
         return f"{user_email} - {book_title} - {self.status}"
 
 
+class ArchivedPayment(models.Model):
+    """
+    دفعات قديمة منتهية (failed / canceled) بدون فاتورة أو كتاب مفتوح،
+    تنقلها compact_payments من جدول Payment حتى يبقى صغيراً.
+    """
+    original_id = models.BigIntegerField()
+    user_id = models.UUIDField(blank=True, null=True)
+    book_id = models.UUIDField(blank=True, null=True)
+    moyasar_id = models.CharField(max_length=100, unique=True)
+    amount = models.IntegerField()
+    status = models.CharField(max_length=20, choices=Payment.PAYMENT_STATUS_CHOICES)
+    currency = models.CharField(max_length=10, default="SAR")
+    description = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    source_type = models.CharField(max_length=50, blank=True, null=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.moyasar_id} - {self.status} (archived)"
+
+
 class Invoice(models.Model):
     INVOICE_STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -83,6 +113,8 @@ class Invoice(models.Model):
             models.Index(fields=['invoice_number']),
             models.Index(fields=['payment']),
             models.Index(fields=['status']),
+            models.Index(fields=['created_at']),
+            models.Index(fields=['status', 'created_at']),
         ]
 
     def __str__(self):
@@ -105,36 +137,89 @@ class Invoice(models.Model):
             self.paid_at = timezone.now()
             self.save()
 
+    @staticmethod
+    def customer_fields(user):
+        """نسخة من بيانات العميل وقت إنشاء الفاتورة، من مستخدم محمّل مسبقاً"""
+        if user is None:
+            return {}
+        return {
+            'customer_name': user.full_name or user.email,
+            'customer_email': user.email,
+            'customer_phone': user.phone or None,
+        }
+
+    @classmethod
+    def for_payment(cls, payment, **fields):
+        """
+        فاتورة غير محفوظة بنسخة بيانات العميل. استخدمها لأي فاتورة تُبنى لـ bulk_create:
+        bulk_create لا يستدعي save() فلا يعمل الاحتياطي أدناه وتبقى حقول العميل فارغة.
+        payment.user يجب أن يكون محمّلاً (select_related('user')) لتجنب استعلام إضافي.
+        """
+        return cls(payment=payment, **cls.customer_fields(payment.user), **fields)
+
     def save(self, *args, **kwargs):
-        # تحديث بيانات العميل من المستخدم المرتبط
-        if not self.customer_name and self.payment and self.payment.user:
-            user = self.payment.user
-            
-            # محاولة الحصول على الاسم من عدة مصادر
-            if hasattr(user, 'first_name') and hasattr(user, 'last_name'):
-                # إذا كان CustomUser يحتوي على first_name و last_name
-                self.customer_name = f"{user.first_name} {user.last_name}".strip()
-            elif hasattr(user, 'full_name'):
-                # إذا كان هناك حقل full_name
-                self.customer_name = user.full_name
-            elif hasattr(user, 'name'):
-                # إذا كان هناك حقل name
-                self.customer_name = user.name
-            else:
-                # الافتراضي هو username
-                self.customer_name = user.username
-            
-            # إذا لم نحصل على اسم، استخدم username
-            if not self.customer_name:
-                self.customer_name = user.username
-                
-            # البريد الإلكتروني
-            self.customer_email = getattr(user, 'email', '')
-            
-            # رقم الهاتف إذا كان موجود
-            if hasattr(user, 'phone'):
-                self.customer_phone = user.phone
-            elif hasattr(user, 'phone_number'):
-                self.customer_phone = user.phone_number
-        
-        super().save(*args, **kwargs)
\ No newline at end of file
+        # احتياطي فقط: المسار الطبيعي يمرر بيانات العميل عند الإنشاء (customer_fields / for_payment)
+        if not self.customer_name and self.payment_id:
+            for field, value in self.customer_fields(self.payment.user).items():
+                setattr(self, field, value)
+
+        super().save(*args, **kwargs)
+
+
+class WebhookEvent(models.Model):
+    """
+    صندوق وارد لأحداث Moyasar: الـ webhook يحفظ الحدث ويرد فوراً،
+    و process_webhooks يعالجه لاحقاً. event_id فريد حتى يكون إعادة الإرسال idempotent.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    event_id = models.CharField(max_length=100, unique=True)
+    event_type = models.CharField(max_length=50)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, null=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['-received_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} {self.event_id} - {self.status}"
+
+
+class PaymentEvent(models.Model):
+    """
+    سجل الانتقالات المطبقة على كل دفعة (paid / failed / refunded).
+    (moyasar_id, event_type) فريد: أول من يسجل الحدث (webhook أو callback أو غيره) هو من يطبقه.
+    """
+    EVENT_CHOICES = [
+        ('paid', 'Paid'),
+        ('failed', 'Failed'),
+        ('refunded', 'Refunded'),
+    ]
+
+    moyasar_id = models.CharField(max_length=100)
+    event_type = models.CharField(max_length=20, choices=EVENT_CHOICES)
+    source = models.CharField(max_length=20)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['moyasar_id', 'event_type'], name='unique_payment_event'),
+        ]
+
+    def __str__(self):
+        return f"{self.moyasar_id} {self.event_type} ({self.source})"
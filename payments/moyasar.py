@@ -1,23 +1,23 @@
 import requests
-import uuid
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ReadTimeoutError
+from urllib3.util.retry import Retry
 from django.conf import settings
-import json
 import logging
 
+from .log import log_payload
+
 
 logger = logging.getLogger(__name__)
 
-def create_payment(given_id, amount, currency, description, token, metadata=None):
-    """
-    إنشاء دفعة باستخدام Tokenization
-    """
-    url = "https://api.moyasar.com/v1/payments"
 
-    payload = {
+def payment_payload(amount, currency, description, token, metadata=None):
+    """جسم طلب إنشاء دفعة بالـ token (مشترك مع AsyncMoyasarClient)"""
+    return {
         "amount": amount,
         "currency": currency,
         "description": description,
-        "callback_url": "https://alc-production-5d34.up.railway.app/payments/callback/",
+        "callback_url": settings.MOYASAR_CALLBACK_URL,
         "metadata": metadata or {},
         "source": {
             "type": "token",
@@ -25,77 +25,110 @@ def create_payment(given_id, amount, currency, description, token, metadata=None
         }
     }
 
-    try:
-        logger.info(f"🚀 Sending payment to Moyasar: {json.dumps(payload, indent=2)}")
-        
-        response = requests.post(
-            url,
-            auth=(settings.MOYASAR_SECRET_KEY, ""),
-            json=payload,
-            headers={
-                "Content-Type": "application/json",
-                "Accept": "application/json"
-            },
-            timeout=30
-        )
-        
-        logger.info(f"📥 Moyasar Response Status: {response.status_code}")
-        logger.info(f"📥 Moyasar Response Body: {response.text}")
-        
-        return response.json(), response.status_code
-    
-    except requests.exceptions.RequestException as e:
-        logger.error(f"❌ Moyasar API Error: {e}", exc_info=True)
-        return {
-            "error": str(e),
-            "message": "Failed to connect to Moyasar API"
-        }, 500
-
-def fetch_payment(payment_id):
-    url = f"https://api.moyasar.com/v1/payments/{payment_id}"
-    headers = {
-        'Accept': 'application/json',
-        'Authorization': f'Basic {settings.MOYASAR_SECRET_KEY}',
-    }
-    response = requests.get(
-            url,
-            auth=(settings.MOYASAR_SECRET_KEY, ""),  # Basic Auth: key + empty password
-    )    
-    return response.json(), response.status_code
-
 
-def list_payments():
+class MoyasarClient:
     """
-    جلب كل الدفعات من Moyasar
+    عميل Moyasar API بجلسة HTTP واحدة مشتركة (connection pool) بدل اتصال جديد في كل طلب.
+    - كل طلب له connect/read timeout
+    - إعادة المحاولة مع backoff لطلبات GET فقط (idempotent)؛ أخطاء الاتصال قبل إرسال الطلب تُعاد لكل الطلبات
     """
-    url = "https://api.moyasar.com/v1/payments"
-    
-    try:
-        response = requests.get(
-            url,
-            auth=(settings.MOYASAR_SECRET_KEY, ""),  # Basic Auth: secret key + empty password
-            headers={"Accept": "application/json"}
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, secret_key=None, base_url=None, timeout=None, max_retries=None,
+                 backoff_factor=None, pool_size=None):
+        self.secret_key = secret_key if secret_key is not None else settings.MOYASAR_SECRET_KEY
+        self.base_url = (base_url or settings.MOYASAR_BASE_URL).rstrip("/") + "/"
+        self.timeout = timeout or (settings.MOYASAR_CONNECT_TIMEOUT, settings.MOYASAR_READ_TIMEOUT)
+        max_retries = settings.MOYASAR_MAX_RETRIES if max_retries is None else max_retries
+        backoff_factor = settings.MOYASAR_RETRY_BACKOFF if backoff_factor is None else backoff_factor
+        pool_size = pool_size or settings.MOYASAR_POOL_SIZE
+
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=self.RETRY_STATUSES,
+            allowed_methods=frozenset({"GET"}),
+            raise_on_status=False,
         )
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        return {"error": str(e)}
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
 
-def refund_payment(payment_id, amount=None):
-    """
-    يرجع مبلغ جزئي أو كامل للعميل.
-    - payment_id: رقم العملية في Moyasar
-    - amount: المبلغ اللي عايز ترجعه (اختياري، لو مش محدد هيرجع كامل المبلغ)
-    """
-    url = f"https://api.moyasar.com/v1/payments/{payment_id}/refund"
-    payload = {}
-    if amount:
-        payload["amount"] = amount
-
-    response = requests.post(
-        url,
-        auth=(settings.MOYASAR_SECRET_KEY, ""),  # Basic Auth: key + empty password
-    
-        data=json.dumps(payload)
-    )
-
-    return response.json()
\ No newline at end of file
+        self.session = requests.Session()
+        self.session.auth = (self.secret_key, "")  # Basic Auth: secret key + empty password
+        self.session.headers.update({"Accept": "application/json"})
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _request(self, method, path, **kwargs):
+        """يرجع (data, status_code)؛ أخطاء الشبكة ترجع كـ 503/504 بدل exception"""
+        url = self.base_url + path.lstrip("/")
+        try:
+            response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+        except requests.exceptions.Timeout as e:
+            logger.error("❌ Moyasar API timeout: %s %s: %s", method, url, e)
+            return {"error": str(e), "message": "Moyasar API timed out"}, 504
+        except requests.exceptions.ConnectionError as e:
+            # بعد استنفاد إعادة المحاولات يلف requests الـ read timeout في ConnectionError(MaxRetryError)
+            if isinstance(getattr(e.args[0] if e.args else None, "reason", None), ReadTimeoutError):
+                logger.error("❌ Moyasar API timeout: %s %s: %s", method, url, e)
+                return {"error": str(e), "message": "Moyasar API timed out"}, 504
+            logger.error("❌ Moyasar API Error: %s %s: %s", method, url, e, exc_info=True)
+            return {"error": str(e), "message": "Failed to connect to Moyasar API"}, 503
+        except requests.exceptions.RequestException as e:
+            logger.error("❌ Moyasar API Error: %s %s: %s", method, url, e, exc_info=True)
+            return {"error": str(e), "message": "Failed to connect to Moyasar API"}, 503
+
+        try:
+            data = response.json()
+        except ValueError:
+            data = {"error": "Invalid response from Moyasar", "body": response.text[:500]}
+        return data, response.status_code
+
+    def create_payment(self, given_id, amount, currency, description, token, metadata=None):
+        """
+        إنشاء دفعة باستخدام Tokenization
+        """
+        payload = payment_payload(amount, currency, description, token, metadata)
+        # بدون الـ token في السجل
+        log_payload(logger, "🚀 Sending payment to Moyasar", dict(payload, source={"type": "token"}))
+        data, status_code = self._request("POST", "payments", json=payload)
+        logger.info("📥 Moyasar Response Status: %s", status_code)
+        log_payload(logger, "📥 Moyasar Response Body", data)
+        return data, status_code
+
+    def fetch_payment(self, payment_id):
+        return self._request("GET", f"payments/{payment_id}")
+
+    def list_payments(self, page=None):
+        """
+        جلب الدفعات من Moyasar (صفحة واحدة)
+        """
+        params = {"page": page} if page else None
+        data, _ = self._request("GET", "payments", params=params)
+        return data
+
+    def refund_payment(self, payment_id, amount=None):
+        """
+        يرجع مبلغ جزئي أو كامل للعميل.
+        - payment_id: رقم العملية في Moyasar
+        - amount: المبلغ اللي عايز ترجعه (اختياري، لو مش محدد هيرجع كامل المبلغ)
+        يرجع (data, status_code) مثل fetch_payment
+        """
+        payload = {}
+        if amount:
+            payload["amount"] = amount
+        return self._request("POST", f"payments/{payment_id}/refund", json=payload)
+
+
+_client = None
+
+
+def get_moyasar_client():
+    """عميل واحد لكل process حتى يُعاد استخدام الاتصالات بين الطلبات"""
+    global _client
+    if _client is None:
+        _client = MoyasarClient()
+    return _client
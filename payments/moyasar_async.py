@@ -0,0 +1,122 @@
+import asyncio
+import logging
+
+import httpx
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .log import log_payload
+from .moyasar import MoyasarClient, payment_payload
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncMoyasarClient:
+    """
+    نسخة async من MoyasarClient (httpx) لوضع ASGI: انتظار Moyasar لا يحجز worker.
+    نفس العقد: كل method ترجع (data, status_code)، وأخطاء الشبكة ترجع كـ 503/504.
+    - إعادة المحاولة مع backoff لطلبات GET فقط؛ أخطاء الاتصال تُعاد لكل الطلبات (طبقة retry واحدة في _request)
+    """
+
+    RETRY_STATUSES = MoyasarClient.RETRY_STATUSES
+
+    def __init__(self, secret_key=None, base_url=None, connect_timeout=None, read_timeout=None,
+                 max_retries=None, backoff_factor=None, pool_size=None, transport=None):
+        secret_key = secret_key if secret_key is not None else settings.MOYASAR_SECRET_KEY
+        base_url = (base_url or settings.MOYASAR_BASE_URL).rstrip("/") + "/"
+        self.max_retries = settings.MOYASAR_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_factor = settings.MOYASAR_RETRY_BACKOFF if backoff_factor is None else backoff_factor
+        pool_size = pool_size or settings.MOYASAR_POOL_SIZE
+
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            auth=(secret_key or "", ""),  # Basic Auth: secret key + empty password
+            headers={"Accept": "application/json"},
+            timeout=httpx.Timeout(
+                read_timeout or settings.MOYASAR_READ_TIMEOUT,
+                connect=connect_timeout or settings.MOYASAR_CONNECT_TIMEOUT,
+            ),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            transport=transport,  # httpx.MockTransport في الاختبارات
+        )
+
+    async def _request(self, method, path, **kwargs):
+        """يرجع (data, status_code)؛ أخطاء الشبكة ترجع كـ 503/504 بدل exception"""
+        path = path.lstrip("/")
+        retry_sent = method == "GET"  # الطلب وصل Moyasar: نعيده فقط لو idempotent
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff_factor * (2 ** (attempt - 1)))
+            last_attempt = attempt == self.max_retries
+            try:
+                response = await self.client.request(method, path, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                # لم يُرسل الطلب بعد، فإعادة المحاولة آمنة لكل الطلبات
+                if not last_attempt:
+                    continue
+                logger.error("❌ Moyasar API Error: %s %s: %s", method, path, e, exc_info=True)
+                return {"error": str(e), "message": "Failed to connect to Moyasar API"}, 503
+            except httpx.TimeoutException as e:
+                if retry_sent and not last_attempt:
+                    continue
+                logger.error("❌ Moyasar API timeout: %s %s: %s", method, path, e)
+                return {"error": str(e), "message": "Moyasar API timed out"}, 504
+            except httpx.HTTPError as e:
+                logger.error("❌ Moyasar API Error: %s %s: %s", method, path, e, exc_info=True)
+                return {"error": str(e), "message": "Failed to connect to Moyasar API"}, 503
+
+            if response.status_code in self.RETRY_STATUSES and retry_sent and not last_attempt:
+                continue
+            try:
+                data = response.json()
+            except ValueError:
+                data = {"error": "Invalid response from Moyasar", "body": response.text[:500]}
+            return data, response.status_code
+
+    async def create_payment(self, given_id, amount, currency, description, token, metadata=None):
+        payload = payment_payload(amount, currency, description, token, metadata)
+        # بدون الـ token في السجل
+        log_payload(logger, "🚀 Sending payment to Moyasar", dict(payload, source={"type": "token"}))
+        data, status_code = await self._request("POST", "payments", json=payload)
+        logger.info("📥 Moyasar Response Status: %s", status_code)
+        log_payload(logger, "📥 Moyasar Response Body", data)
+        return data, status_code
+
+    async def fetch_payment(self, payment_id):
+        return await self._request("GET", f"payments/{payment_id}")
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+# عميل واحد لكل process يفتحه lifespan الـ ASGI في alc/asgi.py عند بدء uvicorn ويغلقه عند الإيقاف
+# (httpx.AsyncClient مربوط بالـ event loop اللي أنشأه، وuvicorn يشغل loop واحد طول عمر الـ process)
+_client = None
+
+
+async def open_async_moyasar_client():
+    global _client
+    if _client is None:
+        _client = AsyncMoyasarClient()
+    return _client
+
+
+async def close_async_moyasar_client():
+    global _client
+    if _client is not None:
+        client, _client = _client, None
+        await client.aclose()
+
+
+def get_async_moyasar_client():
+    """
+    العميل المفتوح في lifespan. runserver و gunicorn (WSGI) يشغلون الـ async views على loop جديد
+    لكل طلب، فكان كل طلب سيترك عميلاً و connection pool مفتوحين؛ لذلك نرفض العمل بدون lifespan.
+    """
+    if _client is None:
+        raise ImproperlyConfigured(
+            "PAYMENTS_ASYNC_VIEWS=True needs uvicorn alc.asgi:application, "
+            "whose lifespan opens the async Moyasar client"
+        )
+    return _client
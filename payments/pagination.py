@@ -0,0 +1,50 @@
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
+
+from .models import Invoice
+
+
+class InvoiceCursorPagination(CursorPagination):
+    """
+    Keyset pagination on created_at (newest first) for the invoice listings.
+    id breaks ties, so invoices created in the same instant keep a stable order across pages.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+def filter_invoices(queryset, request):
+    """Apply ?status=, ?created_from= and ?created_to= (YYYY-MM-DD, inclusive) in SQL"""
+    status = request.query_params.get('status')
+    if status:
+        valid = dict(Invoice.INVOICE_STATUS_CHOICES)
+        if status not in valid:
+            raise ValidationError({"status": f"Must be one of: {', '.join(valid)}."})
+        queryset = queryset.filter(status=status)
+
+    # Compared as a datetime range (not created_at__date) so the created_at index is usable
+    created_from = _parse_day(request, 'created_from')
+    if created_from:
+        queryset = queryset.filter(created_at__gte=created_from)
+    created_to = _parse_day(request, 'created_to')
+    if created_to:
+        queryset = queryset.filter(created_at__lt=created_to + timedelta(days=1))
+
+    return queryset
+
+
+def _parse_day(request, param):
+    """Start of the given day in the current timezone, or None"""
+    value = request.query_params.get(param)
+    if not value:
+        return None
+    day = parse_date(value)
+    if day is None:
+        raise ValidationError({param: "Must be a date (YYYY-MM-DD)."})
+    return timezone.make_aware(datetime.combine(day, time.min))
@@ -1,3 +1,229 @@
-from django.test import TestCase
+import asyncio
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+import httpx
+from django.core.exceptions import ImproperlyConfigured
+from django.test import RequestFactory, SimpleTestCase, TestCase
+
+from users.authentication import tokens_for_user
+from users.models import CustomUser
+from . import async_views
+from .management.commands.moyasar_stub import MoyasarStubHandler, StubServer, StubState
+from .models import Payment
+from .moyasar import MoyasarClient
+from .moyasar_async import AsyncMoyasarClient, get_async_moyasar_client
+
+
+MAX_RETRIES = 2
+CONNECT_ERROR = {"error": mock.ANY, "message": "Failed to connect to Moyasar API"}
+TIMEOUT_ERROR = {"error": mock.ANY, "message": "Moyasar API timed out"}
+
+
+class CountingStubHandler(MoyasarStubHandler):
+    """moyasar_stub handler that counts the requests reaching it"""
+
+    def _route(self):
+        with self.state.lock:
+            self.state.hits += 1
+        return super()._route()
+
+
+class MoyasarStubTestMixin:
+    """Runs the moyasar_stub server on a free port for the duration of one test"""
+
+    def start_stub(self, delay=0, failure_rate=0):
+        state = StubState(delay, failure_rate)
+        state.hits = 0
+        handler = type("Handler", (CountingStubHandler,), {"state": state})
+        server = StubServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return state, f"http://127.0.0.1:{server.server_address[1]}/v1/"
+
+
+class MoyasarClientRetryTests(MoyasarStubTestMixin, SimpleTestCase):
+    """
+    urllib3 retries connect errors for every method, read timeouts and retryable
+    statuses for GET only; network errors come back as 503/504.
+    """
+
+    def moyasar_client(self, base_url="http://127.0.0.1:9/v1/", read_timeout=5):
+        return MoyasarClient(secret_key="sk_test", base_url=base_url, timeout=(1, read_timeout),
+                             max_retries=MAX_RETRIES, backoff_factor=0, pool_size=1)
+
+    def test_connect_error_is_retried_for_get_and_post(self):
+        for method, call in [("GET", lambda c: c.fetch_payment("pay_1")),
+                             ("POST", lambda c: c.refund_payment("pay_1"))]:
+            with self.subTest(method), mock.patch(
+                "urllib3.util.connection.create_connection", side_effect=ConnectionRefusedError
+            ) as connect:
+                data, status_code = call(self.moyasar_client())
+            self.assertEqual(connect.call_count, MAX_RETRIES + 1)
+            self.assertEqual((data, status_code), (CONNECT_ERROR, 503))
+
+    def test_read_timeout_is_retried_for_get_only(self):
+        state, base_url = self.start_stub(delay=0.3)
+        client = self.moyasar_client(base_url, read_timeout=0.1)
+
+        self.assertEqual(client.fetch_payment("pay_1"), (TIMEOUT_ERROR, 504))
+        self.assertEqual(state.hits, MAX_RETRIES + 1)
+
+        state.hits = 0
+        self.assertEqual(client.refund_payment("pay_1"), (TIMEOUT_ERROR, 504))
+        self.assertEqual(state.hits, 1)
+
+    def test_retry_status_is_retried_for_get_only(self):
+        state, base_url = self.start_stub(failure_rate=1)
+        client = self.moyasar_client(base_url)
+
+        data, status_code = client.fetch_payment("pay_1")
+        self.assertEqual((status_code, state.hits), (503, MAX_RETRIES + 1))
+        self.assertEqual(data["message"], "Stub injected failure")
+
+        state.hits = 0
+        _, status_code = client.create_payment("g", 1000, "SAR", "d", "tok")
+        self.assertEqual((status_code, state.hits), (503, 1))
+
+
+def mock_client(handler):
+    return AsyncMoyasarClient(secret_key="sk_test", base_url="http://moyasar.test/v1/",
+                              max_retries=MAX_RETRIES, backoff_factor=0,
+                              transport=httpx.MockTransport(handler))
+
+
+class AsyncMoyasarClientRetryTests(SimpleTestCase):
+    """AsyncMoyasarClient._request follows the same retry rule as MoyasarClient"""
+
+    def request(self, method, handler):
+        attempts = []
+
+        def counting_handler(request):
+            attempts.append(request.method)
+            return handler(request)
+
+        async def run():
+            client = mock_client(counting_handler)
+            try:
+                return await client._request(method, "payments")
+            finally:
+                await client.aclose()
+
+        return asyncio.run(run()), len(attempts)
+
+    def raise_(self, exc_class):
+        def handler(request):
+            raise exc_class("boom", request=request)
+        return handler
+
+    def test_connect_error_is_retried_for_every_method(self):
+        for method in ("GET", "POST"):
+            with self.subTest(method):
+                result, attempts = self.request(method, self.raise_(httpx.ConnectError))
+                self.assertEqual(result, (CONNECT_ERROR, 503))
+                self.assertEqual(attempts, MAX_RETRIES + 1)
+
+    def test_read_timeout_is_retried_for_get_only(self):
+        result, attempts = self.request("GET", self.raise_(httpx.ReadTimeout))
+        self.assertEqual((result, attempts), ((TIMEOUT_ERROR, 504), MAX_RETRIES + 1))
+
+        result, attempts = self.request("POST", self.raise_(httpx.ReadTimeout))
+        self.assertEqual((result, attempts), ((TIMEOUT_ERROR, 504), 1))
+
+    def test_retry_status_is_retried_for_get_only(self):
+        def handler(request):
+            return httpx.Response(503, json={"message": "down"})
+
+        self.assertEqual(self.request("GET", handler), (({"message": "down"}, 503), MAX_RETRIES + 1))
+        self.assertEqual(self.request("POST", handler), (({"message": "down"}, 503), 1))
+
+    def test_success_after_retry(self):
+        responses = iter([httpx.Response(502), httpx.Response(200, json={"id": "pay_1"})])
+        self.assertEqual(self.request("GET", lambda request: next(responses)), (({"id": "pay_1"}, 200), 2))
+
+    def test_client_requires_the_asgi_lifespan(self):
+        with self.assertRaises(ImproperlyConfigured):
+            get_async_moyasar_client()
+
+    def test_lifespan_opens_and_closes_the_client(self):
+        from alc.asgi import application
+
+        async def run():
+            messages = iter([{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}])
+            sent = []
+            clients = []
+
+            async def receive():
+                message = next(messages)
+                if message["type"] == "lifespan.shutdown":
+                    clients.append(get_async_moyasar_client())
+                return message
+
+            async def send(message):
+                sent.append(message["type"])
+
+            await application({"type": "lifespan"}, receive, send)
+            return sent, clients[0]
+
+        sent, client = asyncio.run(run())
+        self.assertEqual(sent, ["lifespan.startup.complete", "lifespan.shutdown.complete"])
+        self.assertTrue(client.client.is_closed)
+        with self.assertRaises(ImproperlyConfigured):
+            get_async_moyasar_client()
+
+
+class AsyncFetchPaymentViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = CustomUser.objects.create_user("s@example.com", "Student", "student", password="x")
+        inactive = CustomUser.objects.create_user("off@example.com", "Off", "student", is_active=False)
+        cls.access = str(tokens_for_user(user).access_token)
+        cls.inactive_access = str(tokens_for_user(inactive).access_token)
+        Payment.objects.create(moyasar_id="pay_1", user=user, amount=1000, status="initiated")
+
+    def patch_gateway(self, handler):
+        return mock.patch.object(async_views, "get_async_moyasar_client", return_value=mock_client(handler))
+
+    def fetch(self, moyasar_id="pay_1", access=None):
+        request = RequestFactory().get(
+            f"/payments/fetch/{moyasar_id}/", HTTP_AUTHORIZATION=f"Bearer {access or self.access}"
+        )
+        return async_views.fetch_payment_view(request, moyasar_id)
+
+    async def test_fetch_updates_the_local_payment(self):
+        with self.patch_gateway(lambda request: httpx.Response(
+            200, json={"id": "pay_1", "status": "paid", "amount": 1000}
+        )):
+            response = await self.fetch()
+        self.assertEqual(response.status_code, 200)
+        payment = await Payment.objects.aget(moyasar_id="pay_1")
+        self.assertEqual(payment.status, "paid")
+
+    async def test_gateway_timeout_is_returned_as_504(self):
+        def handler(request):
+            raise httpx.ReadTimeout("slow", request=request)
+
+        with self.patch_gateway(handler):
+            response = await self.fetch()
+        self.assertEqual(response.status_code, 504)
+
+    async def test_inactive_user_is_rejected(self):
+        with self.patch_gateway(lambda request: httpx.Response(200, json={})):
+            response = await self.fetch(access=self.inactive_access)
+        self.assertEqual(response.status_code, 401)
+
+    async def test_requests_wait_on_a_slow_gateway_concurrently(self):
+        """The load-test property: N fetches against a 0.3s gateway take ~0.3s, not N * 0.3s"""
+        async def slow_handler(request):
+            await asyncio.sleep(0.3)
+            return httpx.Response(200, json={"id": "pay_x", "status": "paid", "amount": 1000})
+
+        started = time.monotonic()
+        with self.patch_gateway(slow_handler):
+            responses = await asyncio.gather(*[self.fetch("pay_x") for _ in range(10)])
+        elapsed = time.monotonic() - started
+
+        self.assertEqual({response.status_code for response in responses}, {200})
+        self.assertLess(elapsed, 1.5)
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 from .views import (
     CreatePaymentView, 
@@ -13,8 +14,13 @@ from .views import (
     test_callback_view,payment_page,CheckValueView
 )
 
+create_payment = CreatePaymentView.as_view()
+if settings.PAYMENTS_ASYNC_VIEWS:
+    # وضع ASGI: نفس المسارات، والـ views اللي تنتظر Moyasar تصبح async
+    from .async_views import create_payment_view as create_payment, fetch_payment_view, payment_callback_view
+
 urlpatterns = [
-    path("create/", CreatePaymentView.as_view(), name="create-payment"),
+    path("create/", create_payment, name="create-payment"),
     path("pay/", payment_page, name="payment_page"),
     path('check-value/', CheckValueView.as_view(), name='check-value'),
     path('fetch/<str:moyasar_id>/', fetch_payment_view, name='fetch-payment'),
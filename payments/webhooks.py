@@ -0,0 +1,108 @@
+import logging
+import traceback
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import WebhookEvent
+
+
+logger = logging.getLogger(__name__)
+
+# حدث في حالة processing أقدم من هذا يعتبر worker مات أثناء معالجته ويُعاد أخذه
+PROCESSING_LEASE = timedelta(minutes=5)
+MAX_ATTEMPTS = 8
+
+
+def event_id_for(payload):
+    """
+    معرّف الحدث من Moyasar؛ لو غير موجود نستخدم النوع + رقم الدفع
+    حتى يبقى إعادة إرسال نفس الحدث idempotent.
+    """
+    event_id = payload.get('id')
+    if event_id:
+        return str(event_id)
+    payment_id = (payload.get('data') or {}).get('id')
+    return f"{payload.get('type')}:{payment_id}"
+
+
+def enqueue_webhook_event(payload):
+    """
+    يحفظ الحدث في الصندوق الوارد. إعادة إرسال نفس الحدث لا تنشئ صف جديد.
+    Returns: (event, created)
+    """
+    return WebhookEvent.objects.get_or_create(
+        event_id=event_id_for(payload),
+        defaults={
+            'event_type': payload.get('type') or '',
+            'payload': payload,
+        },
+    )
+
+
+def claim_events(batch_size, max_attempts=MAX_ATTEMPTS):
+    """
+    يحجز دفعة من الأحداث المستحقة (SELECT ... FOR UPDATE SKIP LOCKED)
+    حتى يمكن تشغيل أكثر من worker بدون معالجة نفس الحدث مرتين.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            WebhookEvent.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(status__in=['pending', 'failed'], next_attempt_at__lte=now)
+                | Q(status='processing', locked_at__lt=now - PROCESSING_LEASE),
+                attempts__lt=max_attempts,
+            )
+            .order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if ids:
+            WebhookEvent.objects.filter(id__in=ids).update(
+                status='processing', locked_at=now, attempts=F('attempts') + 1
+            )
+    return list(WebhookEvent.objects.filter(id__in=ids).order_by('id'))
+
+
+def dispatch_event(event):
+    from .views import handle_payment_paid, handle_payment_failed, handle_payment_refunded
+
+    handlers = {
+        'payment_paid': handle_payment_paid,
+        'payment_failed': handle_payment_failed,
+        'payment_refunded': handle_payment_refunded,
+    }
+    handler = handlers.get(event.event_type)
+    if handler is None:
+        logger.info("ℹ️ Ignoring webhook event type %s", event.event_type)
+        return
+    handler(event.payload.get('data') or {})
+
+
+def retry_delay(attempts):
+    """30s, 1m, 2m, ... حتى ساعة كحد أقصى"""
+    return timedelta(seconds=min(30 * 2 ** (attempts - 1), 60 * 60))
+
+
+def process_event(event):
+    """
+    يعالج حدث واحد ويسجل النتيجة. Returns: True إذا نجح
+    """
+    try:
+        dispatch_event(event)
+    except Exception as e:
+        logger.error("❌ Webhook event %s failed (attempt %s): %s", event.event_id, event.attempts, e, exc_info=True)
+        WebhookEvent.objects.filter(pk=event.pk).update(
+            status='failed',
+            last_error=traceback.format_exc()[-4000:],
+            next_attempt_at=timezone.now() + retry_delay(event.attempts),
+            locked_at=None,
+        )
+        return False
+
+    WebhookEvent.objects.filter(pk=event.pk).update(
+        status='done', processed_at=timezone.now(), last_error=None, locked_at=None
+    )
+    return True
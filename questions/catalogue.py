@@ -0,0 +1,67 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import quote_etag
+from rest_framework.renderers import JSONRenderer
+
+from .models import Book
+from .serializers import BookSerializer
+
+
+def catalogue_version():
+    """
+    (book count, latest Book.updated_at) read from the database, so a change made in
+    another process is seen here without any cross-process invalidation.
+    """
+    aggregate = Book.objects.aggregate(count=Count("id"), updated=Max("updated_at"))
+    updated = aggregate["updated"].isoformat() if aggregate["updated"] else ""
+    return f"{aggregate['count']}:{updated}"
+
+
+def get_book_catalogue():
+    """
+    The public book list as (etag, json_bytes, books), cached per catalogue version.
+    Every book is rendered with is_unlocked=False (the guest view).
+    """
+    key = f"book-catalogue:{catalogue_version()}"
+    entry = cache.get(key)
+    if entry is None:
+        books = [
+            dict(book, is_unlocked=False)
+            for book in BookSerializer(Book.objects.all(), many=True).data
+        ]
+        body = JSONRenderer().render(books)
+        entry = (hashlib.md5(body).hexdigest(), body, books)
+        cache.set(key, entry, settings.CATALOGUE_TIMEOUT)
+    return entry
+
+
+def catalogue_response(request, unlocked_book_ids=None, is_unlocked=None):
+    """
+    Render the catalogue, merging the caller's unlocked books on top of the cached
+    guest view: unlocked_book_ids keys the ETag, is_unlocked(book_id) marks each book.
+    Answers 304 when If-None-Match matches.
+    """
+    catalogue_hash, body, books = get_book_catalogue()
+
+    if unlocked_book_ids is None:
+        etag = quote_etag(catalogue_hash)
+    else:
+        unlocked_hash = hashlib.md5(",".join(sorted(map(str, unlocked_book_ids))).encode()).hexdigest()
+        etag = quote_etag(f"{catalogue_hash}-{unlocked_hash}")
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        if unlocked_book_ids is not None:
+            body = JSONRenderer().render([
+                dict(book, is_unlocked=is_unlocked(book['id'])) for book in books
+            ])
+        response = HttpResponse(body, content_type="application/json")
+
+    response["ETag"] = etag
+    patch_vary_headers(response, ["Authorization"])
+    return response
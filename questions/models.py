@@ -8,6 +8,7 @@ class Book(models.Model):
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     price_sar = models.DecimalField(max_digits=8, decimal_places=2, default=0)  # 💰 مهم لو هتربطه بالدفع
 
 
@@ -0,0 +1,46 @@
+import uuid
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
+
+from .models import QuestionBase
+
+
+class QuestionCursorPagination(CursorPagination):
+    """Keyset pagination on the primary key for the admin question listings"""
+    ordering = 'id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+def filter_questions(queryset, request):
+    """Apply the ?book= and ?difficulty= filters in SQL"""
+    book = request.query_params.get('book')
+    difficulty = request.query_params.get('difficulty')
+
+    if book:
+        try:
+            queryset = queryset.filter(book_id=uuid.UUID(book))
+        except ValueError:
+            raise ValidationError({"book": "Must be a valid book id."})
+
+    if difficulty:
+        valid = dict(QuestionBase.DIFFICULTY_CHOICES)
+        if difficulty not in valid:
+            raise ValidationError({"difficulty": f"Must be one of: {', '.join(valid)}."})
+        queryset = queryset.filter(difficulty=difficulty)
+
+    return queryset
+
+
+def paginate_questions(view, request, queryset, serializer_class, cursor_query_param=None):
+    """
+    Serialize one page of ``queryset``.
+    Returns (results, paginator); use paginator.get_next_link()/get_previous_link() for the cursors.
+    """
+    paginator = QuestionCursorPagination()
+    if cursor_query_param:
+        paginator.cursor_query_param = cursor_query_param
+    page = paginator.paginate_queryset(queryset, request, view=view)
+    return serializer_class(page, many=True).data, paginator
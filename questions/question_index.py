@@ -0,0 +1,86 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import CharField, Value
+
+from alc.cache import shared_cache
+
+from .models import MCQQuestion, MatchingQuestion, TrueFalseQuestion, ReadingComprehension
+
+
+# Same keys as ExamQuestion.QUESTION_TYPES
+QUESTION_MODELS = {
+    "mcq": MCQQuestion,
+    "matching": MatchingQuestion,
+    "truefalse": TrueFalseQuestion,
+    "reading": ReadingComprehension,
+}
+
+
+def _cache_key(book_id):
+    return f"question-index:{book_id}"
+
+
+def build_question_index(book_id):
+    """
+    Read {question_type: {difficulty: [ids]}} for a book straight from the database,
+    as one UNION ALL over the four question tables.
+    """
+    querysets = [
+        model.objects.filter(book_id=book_id)
+        .annotate(question_type=Value(qtype, output_field=CharField()))
+        .values_list("question_type", "difficulty", "id")
+        for qtype, model in QUESTION_MODELS.items()
+    ]
+    rows = querysets[0].union(*querysets[1:], all=True)
+
+    index = {qtype: {} for qtype in QUESTION_MODELS}
+    for qtype, difficulty, qid in rows:
+        index[qtype].setdefault(difficulty, []).append(qid)
+    for by_difficulty in index.values():
+        for ids in by_difficulty.values():
+            ids.sort()
+    return index
+
+
+def _cache():
+    return shared_cache(settings.QUESTION_INDEX_CACHE_ALIAS)
+
+
+def get_question_index(book_id):
+    """
+    {question_type: {difficulty: [ids]}} for a book, cached on
+    settings.QUESTION_INDEX_CACHE_ALIAS (built from the database when that is unset).
+    Invalidated by the question model signals in questions/signals.py.
+    """
+    cache = _cache()
+    if cache is None:
+        return build_question_index(book_id)
+
+    index = cache.get(_cache_key(book_id))
+    if index is None:
+        index = refresh_question_index(book_id)
+    return index
+
+
+def refresh_question_index(book_id):
+    """Rebuild a book's index from the database and store it right away"""
+    index = build_question_index(book_id)
+    cache = _cache()
+    if cache is not None:
+        cache.set(_cache_key(book_id), index, settings.QUESTION_INDEX_TIMEOUT)
+    return index
+
+
+def get_question_counts(book_id):
+    """{question_type: number of questions} for a book"""
+    return {
+        qtype: sum(len(ids) for ids in by_difficulty.values())
+        for qtype, by_difficulty in get_question_index(book_id).items()
+    }
+
+
+def invalidate_question_index(book_id):
+    cache = _cache()
+    if cache is not None:
+        # After commit, so a concurrent request cannot re-cache the old rows
+        transaction.on_commit(lambda: cache.delete(_cache_key(book_id)))
@@ -9,7 +9,7 @@ from .models import (
 class BookSerializer(serializers.ModelSerializer):
     class Meta:
         model = Book
-        fields = '__all__'
+        exclude = ['updated_at']  # internal: catalogue cache version only
 # Base Question Serializer
 # -----------------------------
 class BaseQuestionSerializer(serializers.ModelSerializer):
@@ -116,16 +116,23 @@ class MatchingQuestionSerializer(serializers.ModelSerializer):
             'pairs_count', 'difficulty'
         ]
 
+    # Both fields read obj.pairs.all(), which is served from prefetch_related('pairs')
+    # without extra queries; callers listing questions must prefetch it.
     def get_matching_pairs(self, obj):
-        left_items = [p.left_item for p in obj.pairs.all()]
-        right_items = [p.right_item for p in obj.pairs.all()]
+        pairs = obj.pairs.all()
+        left_items = [p.left_item for p in pairs]
+        right_items = [p.right_item for p in pairs]
         return [
             {"left_item": left_items},
             {"right_item": right_items}
         ]
 
     def get_pairs_count(self, obj):
-        return obj.pairs.count()
+        # Prefer an annotated count (e.g. .annotate(pairs_count=Count('pairs')))
+        pairs_count = getattr(obj, 'pairs_count', None)
+        if pairs_count is not None:
+            return pairs_count
+        return len(obj.pairs.all())
 
     def create(self, validated_data):
         pairs_data = validated_data.pop('pairs')
@@ -0,0 +1,23 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+
+from .question_index import QUESTION_MODELS, invalidate_question_index
+
+
+def remember_previous_book(sender, instance, **kwargs):
+    # A question moved to another book leaves the old book's index stale too
+    instance._previous_book_id = (
+        sender.objects.filter(pk=instance.pk).values_list('book_id', flat=True).first()
+        if instance.pk else None
+    )
+
+
+def invalidate_book_question_index(sender, instance, **kwargs):
+    book_ids = {instance.book_id, getattr(instance, '_previous_book_id', None)}
+    for book_id in book_ids - {None}:
+        invalidate_question_index(book_id)
+
+
+for model in QUESTION_MODELS.values():
+    pre_save.connect(remember_previous_book, sender=model)
+    post_save.connect(invalidate_book_question_index, sender=model)
+    post_delete.connect(invalidate_book_question_index, sender=model)
@@ -1,3 +1,27 @@
 from django.test import TestCase
 
-# Create your tests here.
+from .models import Book, MatchingQuestion, MatchingPair
+from .serializers import MatchingQuestionSerializer
+
+
+class MatchingQuestionQueryCountTests(TestCase):
+    """Serializing matching questions must not query pairs once per question"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title="Book")
+        for i in range(5):
+            question = MatchingQuestion.objects.create(
+                book=cls.book, difficulty="easy", question_text=f"q{i}", text=f"q{i}"
+            )
+            MatchingPair.objects.bulk_create([
+                MatchingPair(question=question, left_item=f"l{j}", right_item=f"r{j}", match_key=f"k{j}")
+                for j in range(3)
+            ])
+
+    def test_prefetched_list_uses_two_queries(self):
+        questions = MatchingQuestion.objects.prefetch_related('pairs')
+        with self.assertNumQueries(2):
+            data = MatchingQuestionSerializer(questions, many=True).data
+        self.assertEqual([q['pairs_count'] for q in data], [3] * 5)
+        self.assertEqual(data[0]['matching_pairs'][0]['left_item'], ["l0", "l1", "l2"])
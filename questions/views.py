@@ -5,12 +5,15 @@ from rest_framework.generics import get_object_or_404
 from django.shortcuts import render
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework import status, permissions
-from users.models import UserBook
+from users.entitlements import get_unlocked_book_ids, has_unlocked_book
 from .models import (
     Book, MCQQuestion, MCQChoice,
     MatchingQuestion, MatchingPair,
     TrueFalseQuestion, ReadingComprehension
 )
+from .question_index import get_question_counts
+from .catalogue import catalogue_response
+from .pagination import filter_questions, paginate_questions
 from .serializers import (
     BookSerializer,
     MCQQuestionSerializer, MCQChoiceSerializer,
@@ -36,24 +39,16 @@ class BookView(APIView):
         return [permissions.IsAdminUser()]
 
     def get(self, request):
-        books = Book.objects.all()
-        serializer = BookSerializer(books, many=True)
-        books_data = serializer.data
-
-        # If user is authenticated, add unlock status for each book
-        if request.user.is_authenticated:
-            open_books = UserBook.objects.filter(
-                user=request.user, status='unlocked'
-            ).values_list('book_id', flat=True)
-
-            for book in books_data:
-                book['is_unlocked'] = str(book['id']) in [str(bid) for bid in open_books]
-
-        else:
-            for book in books_data:
-                book['is_unlocked'] = False  # Guest only
+        # Cached guest catalogue; logged-in users get their unlock status merged on top
+        user = request.user
+        if user.is_authenticated:
+            return catalogue_response(
+                request,
+                unlocked_book_ids=get_unlocked_book_ids(user),
+                is_unlocked=lambda book_id: has_unlocked_book(user, book_id),
+            )
 
-        return Response(books_data, status=status.HTTP_200_OK)
+        return catalogue_response(request)
 
     def post(self, request):
         serializer = BookSerializer(data=request.data)
@@ -83,18 +78,14 @@ class BookDetailView(APIView):
         serializer = BookSerializer(book)
         data = serializer.data
 
-        # Use related_name to access questions directly
+        # Served from the cached per-book question index
+        counts = get_question_counts(book.pk)
         data['statistics'] = {
-            'total_questions': (
-                book.mcq_questions.count() +
-                book.matching_question.count() +
-                book.true_question.count() +
-                book.reading_comprehensions.count()
-            ),
-            'mcq_questions': book.mcq_questions.count(),
-            'matching_question': book.matching_question.count(),
-            'true_questions': book.true_question.count(),           
-            'reading_comprehensions': book.reading_comprehensions.count(),
+            'total_questions': sum(counts.values()),
+            'mcq_questions': counts['mcq'],
+            'matching_question': counts['matching'],
+            'true_questions': counts['truefalse'],
+            'reading_comprehensions': counts['reading'],
         }
         return Response(data)
 
@@ -129,7 +120,8 @@ class BookDetailView(APIView):
 
 class BookQuestionsView(APIView):
     """
-    Get all questions for a specific book
+    Get the questions of a specific book, paginated per question type
+    (?mcq_cursor=, ?matching_cursor=, ?truefalse_cursor=, ?reading_cursor=)
     """
     permission_classes = [permissions.IsAdminUser]
     authentication_classes = [JWTAuthentication]
@@ -139,25 +131,40 @@ class BookQuestionsView(APIView):
         except Book.DoesNotExist:
             return Response({"detail": "Book not found."}, status=status.HTTP_404_NOT_FOUND)
         
-        # Get all question types for this book
-        # Query directly from reverse relations
-        mcq_questions = book.mcq_questions.all()
-        matching_questions = book.matching_question.all()
-        true_question = book.true_question.all()
+        # One cursor page per question type; each type has its own cursor parameter
+        sections = {
+            'mcq': (book.mcq_questions.prefetch_related('choices'), MCQQuestionSerializer),
+            'matching': (book.matching_question.prefetch_related('pairs'), MatchingQuestionSerializer),
+            'truefalse': (book.true_question.all(), TrueFalseQuestionSerializer),
+            'reading': (book.reading_comprehensions.select_related('book'), ReadingComprehensionSerializer),
+        }
+        pages = {}
+        pagination = {}
+        for name, (queryset, serializer_class) in sections.items():
+            results, paginator = paginate_questions(
+                self, request, filter_questions(queryset, request), serializer_class,
+                cursor_query_param=f'{name}_cursor'
+            )
+            pages[name] = results
+            pagination[name] = {
+                'next': paginator.get_next_link(),
+                'previous': paginator.get_previous_link(),
+            }
+        counts = get_question_counts(book.pk)
 
-        
         data = {
             'book': BookSerializer(book).data,
             'questions': {
-                'mcq': MCQQuestionSerializer(mcq_questions, many=True).data,
-                'matching': MatchingQuestionSerializer(matching_questions, many=True).data,
-                'truefalse': TrueFalseQuestionSerializer(true_question , many=True).data,
+                'mcq': pages['mcq'],
+                'matching': pages['matching'],
+                'truefalse': pages['truefalse'],
             },
-            'reading_passages': ReadingComprehensionSerializer(book.reading_comprehensions.all(), many=True).data,
+            'reading_passages': pages['reading'],
+            'pagination': pagination,
             'statistics': {
-                'total_mcq': mcq_questions.count(),
-                'total_matching': matching_questions.count(),
-                'total_truefalse': true_question.count(),
+                'total_mcq': counts['mcq'],
+                'total_matching': counts['matching'],
+                'total_truefalse': counts['truefalse'],
             }
         }
         
@@ -334,9 +341,9 @@ class MCQQuestionView(APIView):
     permission_classes = [permissions.IsAdminUser]
     authentication_classes = [JWTAuthentication]
     def get(self, request):
-        questions = MCQQuestion.objects.prefetch_related('choices').all()
-        serializer = MCQQuestionSerializer(questions, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        questions = filter_questions(MCQQuestion.objects.prefetch_related('choices'), request)
+        results, paginator = paginate_questions(self, request, questions, MCQQuestionSerializer)
+        return paginator.get_paginated_response(results)
 
     def post(self, request):
         serializer = MCQQuestionSerializer(data=request.data)
@@ -377,9 +384,9 @@ class MatchingQuestionView(APIView):
     permission_classes = [permissions.IsAdminUser]
     authentication_classes = [JWTAuthentication]
     def get(self, request):
-        questions = MatchingQuestion.objects.prefetch_related('pairs').all()
-        serializer = MatchingQuestionSerializer(questions, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        questions = filter_questions(MatchingQuestion.objects.prefetch_related('pairs'), request)
+        results, paginator = paginate_questions(self, request, questions, MatchingQuestionSerializer)
+        return paginator.get_paginated_response(results)
 
     def post(self, request):
         serializer = MatchingQuestionSerializer(data=request.data)
@@ -396,7 +403,7 @@ class MatchingQuestionDetailView(APIView):
         return get_object_or_404(MatchingQuestion, pk=pk)
 
     def get(self, request, pk):
-        question = self.get_object(pk)
+        question = get_object_or_404(MatchingQuestion.objects.prefetch_related('pairs'), pk=pk)
         serializer = MatchingQuestionSerializer(question)
         return Response(serializer.data)
 
@@ -420,9 +427,9 @@ class TrueFalseQuestionView(APIView):
     permission_classes = [permissions.IsAdminUser]
     authentication_classes = [JWTAuthentication]
     def get(self, request):
-        questions = TrueFalseQuestion.objects.all()
-        serializer = TrueFalseQuestionSerializer(questions, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        questions = filter_questions(TrueFalseQuestion.objects.all(), request)
+        results, paginator = paginate_questions(self, request, questions, TrueFalseQuestionSerializer)
+        return paginator.get_paginated_response(results)
 
     def post(self, request):
         serializer = TrueFalseQuestionSerializer(data=request.data)
@@ -465,15 +472,17 @@ class ReadingComprehensionListCreateView(APIView):
     permission_classes = [permissions.IsAdminUser]
     authentication_classes = [JWTAuthentication]
     def get(self, request):
-        """Display all reading passages"""
+        """Display reading passages, one cursor page at a time"""
+        comprehensions = filter_questions(ReadingComprehension.objects.select_related('book'), request)
+        results, paginator = paginate_questions(
+            self, request, comprehensions, ReadingComprehensionSerializer
+        )
         try:
-            comprehensions = ReadingComprehension.objects.select_related('book').all()
-            serializer = ReadingComprehensionSerializer(comprehensions, many=True)
-            
             return Response({
                 'success': True,
-                'count': comprehensions.count(),
-                'data': serializer.data
+                'next': paginator.get_next_link(),
+                'previous': paginator.get_previous_link(),
+                'data': results
             }, status=status.HTTP_200_OK)
             
         except Exception as e:
@@ -0,0 +1,99 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import CustomUser
+from .tokens import CachedBlacklistRefreshToken
+
+
+# Informational claims for clients; authorization reads them from get_user_status()
+CLAIM_FIELDS = ('is_staff', 'user_type')
+
+
+def tokens_for_user(user):
+    """RefreshToken for the user, carrying CLAIM_FIELDS (copied to its access token too)"""
+    tokens = CachedBlacklistRefreshToken.for_user(user)
+    for field in CLAIM_FIELDS:
+        tokens[field] = getattr(user, field)
+    return tokens
+
+
+STATUS_FIELDS = ('is_active', 'is_staff', 'is_superuser', 'user_type')
+
+
+def _status_key(user_id):
+    return f"user-status:{user_id}"
+
+
+def get_user_status(user_id):
+    """
+    {STATUS_FIELDS: value} of the user, cached for USER_STATUS_TIMEOUT seconds
+    ({'is_active': False} for a deleted user). Invalidated by the CustomUser signals
+    in users/signals.py; the TTL bounds staleness in the other processes.
+    """
+    key = _status_key(user_id)
+    status = cache.get(key)
+    if status is None:
+        status = (
+            CustomUser.objects.filter(pk=user_id).values(*STATUS_FIELDS).first()
+            or {'is_active': False}
+        )
+        cache.set(key, status, settings.USER_STATUS_TIMEOUT)
+    return status
+
+
+def invalidate_user_status(user_id):
+    transaction.on_commit(lambda: cache.delete(_status_key(user_id)))
+
+
+class ClaimsUser(TokenUser):
+    """
+    Request user built from the access token's user_id plus the cached user status.
+    Roles come from the status, not from the token claims: those are copied forward on
+    every refresh and would outlive a demotion. The CustomUser row is only loaded when
+    a view asks for `instance`.
+    """
+
+    def __init__(self, token, status):
+        super().__init__(token)
+        self.status = status
+
+    @cached_property
+    def is_staff(self):
+        return self.status['is_staff']
+
+    @cached_property
+    def is_superuser(self):
+        return self.status['is_superuser']
+
+    @cached_property
+    def user_type(self):
+        return self.status['user_type']
+
+    @cached_property
+    def instance(self):
+        return CustomUser.objects.get(pk=self.id)
+
+    def allows_multiple_devices(self):
+        return self.user_type == 'admin'
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication without the per-request CustomUser lookup: the user is the token's
+    user_id, with active flag and roles read through the status cache.
+    """
+
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise AuthenticationFailed(_("Token contained no recognizable user identification"))
+        status = get_user_status(validated_token[api_settings.USER_ID_CLAIM])
+        if not status['is_active']:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return ClaimsUser(validated_token, status)
@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.db import transaction
+
+from alc.cache import shared_cache
+from .models import UserBook
+
+
+def _cache_key(user_id):
+    return f"unlocked-books:{user_id}"
+
+
+def _query_unlocked_book_ids(user_id):
+    return frozenset(
+        str(book_id) for book_id in UserBook.objects.filter(
+            user_id=user_id, status='unlocked', book__isnull=False
+        ).values_list('book_id', flat=True)
+    )
+
+
+def get_unlocked_book_ids(user):
+    """
+    frozenset of str(book_id) the user has unlocked, cached per user on
+    settings.UNLOCKED_BOOKS_CACHE_ALIAS (one indexed query when that is unset) and
+    memoised on the user object for the rest of the request.
+    Invalidated by the UserBook signals in users/signals.py.
+    """
+    if not hasattr(user, '_unlocked_book_ids'):
+        user._unlocked_book_ids = _load_unlocked_book_ids(user.pk)
+    return user._unlocked_book_ids
+
+
+def _load_unlocked_book_ids(user_id):
+    cache = shared_cache(settings.UNLOCKED_BOOKS_CACHE_ALIAS)
+    if cache is None:
+        return _query_unlocked_book_ids(user_id)
+
+    key = _cache_key(user_id)
+    book_ids = cache.get(key)
+    if book_ids is None:
+        book_ids = _query_unlocked_book_ids(user_id)
+        cache.set(key, book_ids, settings.UNLOCKED_BOOKS_TIMEOUT)
+    return book_ids
+
+
+def has_unlocked_book(user, book_id):
+    if not user.is_authenticated:
+        return False
+    return str(book_id) in get_unlocked_book_ids(user)
+
+
+def invalidate_unlocked_books(user_id):
+    cache = shared_cache(settings.UNLOCKED_BOOKS_CACHE_ALIAS)
+    if cache is not None:
+        # After commit, so a concurrent request cannot re-cache the pre-unlock state
+        transaction.on_commit(lambda: cache.delete(_cache_key(user_id)))
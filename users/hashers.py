@@ -0,0 +1,11 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class TunablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2 with the iteration count taken from settings.PASSWORD_PBKDF2_ITERATIONS.
+    Same algorithm name as Django's hasher, so existing hashes keep working and are
+    re-hashed to the configured cost on the next successful login.
+    """
+    iterations = settings.PASSWORD_PBKDF2_ITERATIONS
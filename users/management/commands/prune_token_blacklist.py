@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired outstanding refresh tokens (and their blacklist rows) in bounded batches. "
+        "Meant to run on a schedule."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000, help="Tokens per DELETE batch")
+        parser.add_argument("--max-batches", type=int, default=0,
+                            help="Stop after this many batches (0 = until done)")
+        parser.add_argument("--dry-run", action="store_true", help="Only count what would be removed")
+
+    def handle(self, *args, **options):
+        expired = OutstandingToken.objects.filter(expires_at__lte=aware_utcnow())
+
+        if options["dry_run"]:
+            self.stdout.write(f"Would delete {expired.count()} expired tokens")
+            return
+
+        # Keyset walk over the primary key: expired tokens are the oldest rows, so each batch
+        # reads the pk index from where the previous one stopped instead of rescanning the table
+        total = batches = last_pk = 0
+        while True:
+            ids = list(
+                expired.filter(pk__gt=last_pk).order_by("pk").values_list("pk", flat=True)[:options["batch_size"]]
+            )
+            if not ids:
+                break
+            last_pk = ids[-1]
+            # BlacklistedToken rows go with their token (ON DELETE CASCADE, one DELETE per batch)
+            _, deleted = OutstandingToken.objects.filter(pk__in=ids).delete()
+            total += deleted.get(OutstandingToken._meta.label, 0)
+            batches += 1
+            if options["max_batches"] and batches >= options["max_batches"]:
+                break
+
+        self.stdout.write(f"Deleted {total} expired tokens")
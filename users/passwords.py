@@ -0,0 +1,57 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+from django.db import connections
+
+from .models import CustomUser
+
+
+logger = logging.getLogger(__name__)
+
+_rehash_pool = None
+
+
+def _get_rehash_pool():
+    global _rehash_pool
+    if _rehash_pool is None:
+        _rehash_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="password-rehash")
+    return _rehash_pool
+
+
+def _store_rehash(user_pk, old_encoded, raw_password):
+    """
+    Re-hash with the current hasher settings and save only the password column,
+    and only if the password was not changed in the meantime.
+    """
+    try:
+        CustomUser.objects.filter(pk=user_pk, password=old_encoded).update(
+            password=make_password(raw_password)
+        )
+    except Exception:
+        logger.exception("Password rehash failed for user %s", user_pk)
+
+
+def _background_rehash(user_pk, old_encoded, raw_password):
+    try:
+        _store_rehash(user_pk, old_encoded, raw_password)
+    finally:
+        connections.close_all()
+
+
+def verify_password(user, raw_password):
+    """
+    Check ``raw_password`` against an already-loaded user (no extra query).
+    When the stored hash uses outdated hasher settings it is upgraded with a
+    single-column UPDATE, on a background thread if PASSWORD_REHASH_IN_BACKGROUND.
+    """
+    old_encoded = user.password
+
+    def setter(raw):
+        if settings.PASSWORD_REHASH_IN_BACKGROUND:
+            _get_rehash_pool().submit(_background_rehash, user.pk, old_encoded, raw)
+        else:
+            _store_rehash(user.pk, old_encoded, raw)
+
+    return check_password(raw_password, old_encoded, setter)
@@ -5,6 +5,8 @@ from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
 from django.utils import timezone
+from .passwords import verify_password
+from .authentication import tokens_for_user
 
 
 from rest_framework import serializers
@@ -36,7 +38,7 @@ class RegisterSerializer(serializers.ModelSerializer):
         return user
 
     def to_representation(self, instance):
-        tokens = RefreshToken.for_user(instance)
+        tokens = tokens_for_user(instance)
         return {
             "user": {
                 "id": instance.id,
@@ -65,14 +67,19 @@ class LoginSerializer(serializers.Serializer):
         email = data.get("email")
         password = data.get("password")
 
-        user = authenticate(email=email, password=password)
+        # LoginView passes the user it already loaded, so the password is checked without a second fetch.
+        # Like authenticate(), a deactivated account is rejected with the same message as a wrong
+        # password, so the response confirms neither the account nor the password
+        user = self.context.get('user')
+        if user is None:
+            user = authenticate(email=email, password=password)
+        elif not verify_password(user, password) or not user.is_active:
+            user = None
 
         if user is None:
-            raise serializers.ValidationError({"error_message": "Invalid email or password."})
-        if not user.is_active:
-            raise serializers.ValidationError({"error_message": "User is deactivated."})
+            raise serializers.ValidationError({"error_message": "Invalid credentials."})
 
-        tokens = RefreshToken.for_user(user)
+        tokens = tokens_for_user(user)
 
         return {
             "user": {
@@ -0,0 +1,21 @@
+from django.db.models.signals import post_save, post_delete
+
+from .authentication import invalidate_user_status
+from .entitlements import invalidate_unlocked_books
+from .models import CustomUser, UserBook
+
+
+def invalidate_user_active(sender, instance, **kwargs):
+    invalidate_user_status(instance.pk)
+
+
+post_save.connect(invalidate_user_active, sender=CustomUser)
+post_delete.connect(invalidate_user_active, sender=CustomUser)
+
+
+def invalidate_user_books(sender, instance, **kwargs):
+    invalidate_unlocked_books(instance.user_id)
+
+
+post_save.connect(invalidate_user_books, sender=UserBook)
+post_delete.connect(invalidate_user_books, sender=UserBook)
@@ -0,0 +1,109 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import SimpleRateThrottle
+
+
+STATS_KEY = "throttle-stats:{scope}:{counter}"
+STATS_TIMEOUT = 7 * 24 * 60 * 60
+
+
+def _incr(cache, key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Missing key; add() keeps a concurrent first increment from being overwritten
+        if not cache.add(key, 1, STATS_TIMEOUT):
+            cache.incr(key)
+
+
+def request_email_hash(request):
+    """Hash of the email in the request body, whether or not the account exists"""
+    email = request.data.get('email') if hasattr(request.data, 'get') else None
+    if not email or not isinstance(email, str):
+        return None
+    return hashlib.sha256(email.strip().lower().encode()).hexdigest()
+
+
+class CacheRateThrottle(SimpleRateThrottle):
+    """
+    Sliding-window throttle (DRF keeps the request timestamps of the window in the cache)
+    on the cache alias settings.THROTTLE_CACHE_ALIAS. Use a shared backend (file, database,
+    memcached) there when running several workers. Rates live in
+    REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] under each scope.
+
+    Requests are keyed on the client IP (DRF's get_ident, which trusts X-Forwarded-For
+    only as far as NUM_PROXIES allows); subclasses override get_cache_key to key otherwise.
+
+    Every check and every rejection is counted for monitoring (see throttle_stats()).
+    """
+
+    def __init__(self):
+        self.cache = caches[settings.THROTTLE_CACHE_ALIAS]
+        super().__init__()
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+    def allow_request(self, request, view):
+        allowed = super().allow_request(request, view)
+        if getattr(self, 'key', None) is not None:
+            _incr(self.cache, STATS_KEY.format(scope=self.scope, counter="requests"))
+            if not allowed:
+                _incr(self.cache, STATS_KEY.format(scope=self.scope, counter="throttled"))
+        return allowed
+
+
+class LoginIPThrottle(CacheRateThrottle):
+    scope = 'login_ip'
+
+
+class LoginEmailThrottle(CacheRateThrottle):
+    scope = 'login_email'
+
+    def get_cache_key(self, request, view):
+        ident = request_email_hash(request)
+        if not ident:
+            return None
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+
+class PasswordResetIPThrottle(CacheRateThrottle):
+    scope = 'password_reset_ip'
+
+
+class PasswordResetEmailThrottle(CacheRateThrottle):
+    scope = 'password_reset_email'
+
+    def get_cache_key(self, request, view):
+        ident = request_email_hash(request)
+        if not ident:
+            return None
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+
+THROTTLE_SCOPES = [
+    LoginIPThrottle.scope, LoginEmailThrottle.scope,
+    PasswordResetIPThrottle.scope, PasswordResetEmailThrottle.scope,
+]
+
+
+def throttle_stats():
+    """{scope: {"rate", "requests", "throttled"}} for the auth throttles"""
+    cache = caches[settings.THROTTLE_CACHE_ALIAS]
+    keys = {
+        (scope, counter): STATS_KEY.format(scope=scope, counter=counter)
+        for scope in THROTTLE_SCOPES
+        for counter in ("requests", "throttled")
+    }
+    values = cache.get_many(list(keys.values()))
+    rates = settings.REST_FRAMEWORK.get('DEFAULT_THROTTLE_RATES', {})
+    return {
+        scope: {
+            "rate": rates.get(scope),
+            "requests": values.get(keys[(scope, "requests")], 0),
+            "throttled": values.get(keys[(scope, "throttled")], 0),
+        }
+        for scope in THROTTLE_SCOPES
+    }
@@ -0,0 +1,44 @@
+from django.core.cache import cache
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import aware_utcnow, datetime_from_epoch
+
+
+def _blacklist_key(jti):
+    return f"jwt-blacklisted:{jti}"
+
+
+def _remember_blacklisted(token):
+    """Caches the blacklisted jti until the token would have expired anyway"""
+    remaining = (datetime_from_epoch(token["exp"]) - aware_utcnow()).total_seconds()
+    if remaining > 0:
+        cache.set(_blacklist_key(token[api_settings.JTI_CLAIM]), True, int(remaining) + 1)
+
+
+class CachedBlacklistRefreshToken(RefreshToken):
+    """
+    RefreshToken whose blacklist check is answered from the cache for tokens already known
+    to be blacklisted (rotated or logged out) - the replay case. Only positive answers are
+    cached: a miss still asks the token_blacklist tables, which remain the source of truth,
+    since another worker may have blacklisted the token without this cache seeing it.
+    """
+
+    def check_blacklist(self):
+        if cache.get(_blacklist_key(self.payload[api_settings.JTI_CLAIM])):
+            raise TokenError("Token is blacklisted")
+        try:
+            super().check_blacklist()
+        except TokenError:
+            _remember_blacklisted(self)
+            raise
+
+    def blacklist(self):
+        result = super().blacklist()
+        _remember_blacklisted(self)
+        return result
+
+
+class CachedBlacklistTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = CachedBlacklistRefreshToken
@@ -2,7 +2,7 @@ from django.urls import path
 from .views import (
     RegisterView, LoginView, LogoutView, 
     ChangePasswordView, ProfileView, ForgotPasswordView,ResetPasswordConfirmView,CustomTokenRefreshView,PasswordResetRequestList
-,support,privacy,DeleteUserView
+,support,privacy,DeleteUserView,ThrottleStatsView
 )
 from rest_framework_simplejwt.views import TokenRefreshView
 
@@ -20,6 +20,7 @@ urlpatterns = [
     path('privacy/', privacy, name='privacy'),
     path('support/', support, name='support'),
     path('delete-account/', DeleteUserView.as_view(), name='delete-account'),
+    path('throttle-stats/', ThrottleStatsView.as_view(), name='throttle-stats'),
 
 
 ]
\ No newline at end of file
@@ -8,6 +8,7 @@ from django.core.mail import send_mail
 from django.conf import settings
 from django.utils import timezone
 from datetime import timedelta
+from django.db.models import Case, F, Value, When
 import logging
 from .models import CustomUser
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
@@ -17,6 +18,10 @@ from rest_framework_simplejwt.views import TokenRefreshView
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from django.shortcuts import render
 from .models import PasswordResetRequest
+from .tokens import CachedBlacklistRefreshToken, CachedBlacklistTokenRefreshSerializer
+from .throttling import (
+    LoginIPThrottle, LoginEmailThrottle, PasswordResetIPThrottle, PasswordResetEmailThrottle, throttle_stats
+)
 from rest_framework.permissions import AllowAny
 
 
@@ -38,6 +43,7 @@ logger = logging.getLogger(__name__)
 class LoginView(APIView):
     permission_classes = []
     authentication_classes = []
+    throttle_classes = [LoginIPThrottle, LoginEmailThrottle]
 
     def post(self, request):
         ip_address = self.get_client_ip(request)
@@ -66,21 +72,27 @@ class LoginView(APIView):
                 status=status.HTTP_423_LOCKED
             )
         
-        # Validate password
-        serializer = LoginSerializer(data=request.data, context={'request': request})
+        # Validate password (reuses the user loaded above)
+        serializer = LoginSerializer(data=request.data, context={'request': request, 'user': user})
         if not serializer.is_valid():
-            user.failed_login_attempts += 1
-            if user.failed_login_attempts >= 5:
-                user.account_locked_until = timezone.now() + timedelta(minutes=15)
-            user.save()
+            # One UPDATE of the two lockout columns; the counter is incremented in SQL so
+            # concurrent failures are all counted (the Case reads the pre-update value).
+            # A deactivated account is not counted: its password may well have been correct
+            CustomUser.objects.filter(pk=user.pk, is_active=True).update(
+                failed_login_attempts=F('failed_login_attempts') + 1,
+                account_locked_until=Case(
+                    When(failed_login_attempts__gte=4, then=Value(timezone.now() + timedelta(minutes=15))),
+                    default=F('account_locked_until'),
+                ),
+            )
             message = serializer.errors.get('error_message', ["Invalid credentials."])[0]
             return Response({"error_message": message}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Successful login
-        user.failed_login_attempts = 0
-        user.account_locked_until = None
-        user.last_login_ip = ip_address
-        user.save()
+        # Successful login: write only when something actually changed
+        if user.failed_login_attempts or user.account_locked_until or user.last_login_ip != ip_address:
+            CustomUser.objects.filter(pk=user.pk).update(
+                failed_login_attempts=0, account_locked_until=None, last_login_ip=ip_address
+            )
 
         logger.info(f"✅ Successful login for {email} from IP: {ip_address}")
         return Response(serializer.validated_data, status=status.HTTP_200_OK)
@@ -104,7 +116,7 @@ class LogoutView(APIView):
                 )
 
             # Blacklist the token
-            token = RefreshToken(refresh_token)
+            token = CachedBlacklistRefreshToken(refresh_token)
             token.blacklist()
 
             return Response(
@@ -153,6 +165,7 @@ class ProfileView(APIView):
 class ForgotPasswordView(APIView):
     permission_classes = []
     authentication_classes = []
+    throttle_classes = [PasswordResetIPThrottle, PasswordResetEmailThrottle]
 
     def post(self, request):
         serializer = ForgotPasswordSerializer(data=request.data)
@@ -214,8 +227,9 @@ class CustomTokenRefreshView(TokenRefreshView):
     """
     Use the standard TokenRefreshView from simplejwt
     Refreshes the access token using the refresh token
+    (blacklisted tokens are recognised from the cache, see users/tokens.py)
     """
-    pass 
+    serializer_class = CachedBlacklistTokenRefreshSerializer
 
 def custom_404(request, exception):
     return render(request, "errors/404.html", status=404)
@@ -247,6 +261,13 @@ class PasswordResetRequestList(APIView):
         except PasswordResetRequest.DoesNotExist:
             return Response({"error": "Request not found."}, status=404)
 
+class ThrottleStatsView(APIView):
+    """Request / rejection counters of the login and password-reset throttles"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(throttle_stats())
+
 class DeleteUserView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 